@@ -58,15 +58,18 @@ if __name__ == "__main__":
     print("Testing ME405 stuff in cotask.py and task_share.py\r\n"
           "Press Ctrl-C to stop and show diagnostics.")
 
-    # Create a share and a queue to test function and diagnostic printouts
-    share0 = task_share.Share('h', thread_protect=False, name="Share 0")
-    q0 = task_share.Queue('L', 16, thread_protect=False, overwrite=False,
-                          name="Queue 0")
-
-    # Create the tasks. If trace is enabled for any task, memory will be
-    # allocated for state transition tracing, and the application will run out
-    # of memory after a while and quit. Therefore, use tracing only for 
-    # debugging and set trace to False when it's not needed
+    # Create a share and a queue to test function and diagnostic printouts.
+    # They're declared to an arena so that their memory is allocated at once
+    arena = task_share.Arena()
+    arena.add(task_share.Share, 'h', thread_protect=False, name="Share 0")
+    arena.add(task_share.Queue, 'L', 16, thread_protect=False,
+              overwrite=False, name="Queue 0")
+    share0, q0 = arena.build()
+
+    # Create the tasks. If trace is enabled for any task, a fixed amount of
+    # memory is allocated to hold its most recent state transitions, and
+    # tracing slows the task down slightly; set trace to False when it's not
+    # needed
     task1 = cotask.Task(task1_fun, name="Task_1", priority=1, period=400,
                         profile=True, trace=False, shares=(share0, q0))
     task2 = cotask.Task(task2_fun, name="Task_2", priority=2, period=1500,
@@ -28,9 +28,29 @@ ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
 SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
-import gc                              # Memory allocation garbage collector
+import array                           # Fixed size buffers for tracing
+import struct                          # Packs traces into binary form
 import utime                           # Micropython version of time library
 import micropython                     # This shuts up incorrect warnings
+import pyb                             # Hardware timers can release tasks
+import machine                         # Used to idle the CPU between runs
+from histogram import Histogram        # Run time and lateness distributions
+
+
+## Overrun policy for periodic tasks: after a late run, the next run time is
+#  one period after the previous one, so a task which has fallen several
+#  periods behind runs repeatedly until it has caught up. This is the default.
+CATCH_UP = 0
+
+## Overrun policy for periodic tasks: periods which have already been missed
+#  are skipped, and the task runs next at the first time on its original grid
+#  of run times which is still in the future.
+SKIP = 1
+
+## Overrun policy for periodic tasks: periods which have been missed are
+#  skipped and the grid of run times is moved so that the task runs next one
+#  period after the time at which it was found to be late.
+REALIGN = 2
 
 
 class Task:
@@ -68,9 +88,15 @@ class Task:
       @endcode
       """
 
+    ## Flag which is set by @c go() for any task. It tells the deadline
+    #  scheduler @c TaskList.dl_sched() that it must look for go flags, which
+    #  it otherwise doesn't need to do.
+    _go_pending = False
+
 
     def __init__(self, run_fun, name="NoName", priority=0, period=None,
-                 profile=False, trace=False, shares=()):
+                 profile=False, trace=False, shares=(), trace_size=100,
+                 overrun=CATCH_UP):
         """!
         Initialize a task object so it may be run by the scheduler.
 
@@ -88,10 +114,23 @@ class Task:
                The time can be given in a @c float or @c int; it will be 
                converted to microseconds for internal use by the scheduler.
         @param profile Set to @c True to enable run-time profiling 
-        @param trace Set to @c True to generate a list of transitions between
-               states. @b Note: This slows things down and allocates memory.
+        @param trace Set to @c True to keep a record of transitions between
+               states. States are recorded as 32-bit integers; a state which
+               isn't an integer or doesn't fit is recorded as -1.
+               @b Note: This slows things down a little.
         @param shares A list or tuple of shares and queues used by this task.
                If no list is given, no shares are passed to the task
+        @param trace_size The number of most recent state transitions which
+               are kept if @c trace is @c True (default 100). Memory for them
+               is allocated here, so tracing doesn't allocate any more
+        @param overrun What a periodic task does when it has fallen more than
+               one period behind, for example after a long blocking call:
+               @c CATCH_UP (the default) runs it once for each missed period,
+               @c SKIP skips missed periods and keeps to the original timing,
+               and @c REALIGN skips missed periods and restarts the timing
+               from the time at which the task was released. This has no
+               effect on a task released by a hardware timer; see
+               @c bind_timer()
         """
         # The function which is run to implement this task's code. Since it 
         # is a generator, we "run" it here, which doesn't actually run it but
@@ -120,25 +159,76 @@ class Task:
             self.period = period
             self._next_run = None
 
+        # Flag which is true if the scheduler checks the time to see if this
+        # task is due to run. It's false for tasks without a period and for
+        # tasks released by a hardware timer; see bind_timer()
+        self._polled = period != None
+        self._timer = None
+
+        # The deadline heap of the task list this task has been appended to,
+        # so that a task which becomes polled again can be put back into it
+        self._heap = None
+
+        # The time by which the task's current run should be finished, used by
+        # the earliest-deadline-first scheduler
+        self._deadline = self._next_run
+
+        # What to do when the task falls more than a period behind
+        self._overrun = overrun
+
+        # The run time of the task's latest release, and a flag which is set
+        # until the task has started that run, so that run() can find how
+        # late the task started
+        self._release = 0
+        self._late_due = False
+
+        # The task has no execution time budget until set_budget() is called
+        self._budget = 0
+        self._on_overrun = None
+        self._throttle_after = 0
+        self._throttle_skip = 0
+        self._hold = 0
+
         # Flag which causes the task to be profiled, in which the execution
         #  time of the @c run() method is measured and basic statistics kept. 
+        #  Histograms of run time and lateness are allocated only if needed
         self._prof = profile
+        self._timed = profile
+        if profile:
+            self._run_hist = Histogram()
+            self._late_hist = Histogram()
+        else:
+            self._run_hist = None
+            self._late_hist = None
         self.reset_profile()
 
         # The previous state in which the task last ran. It is used to watch
         # for and track state transitions.
         self._prev_state = 0
 
-        # If transition tracing has been enabled, create an empty list in 
-        # which to store transition (time, to-state) stamps
+        # If transition tracing has been enabled, create ring buffers in which
+        # to store the time since the previous transition and the state to
+        # which each transition went. When the buffers are full, the oldest
+        # transitions are overwritten
         self._trace = trace
-        self._tr_data = []
+        if trace:
+            self._tr_size = int(trace_size)
+            self._tr_time = array.array('L', range(self._tr_size))
+            self._tr_state = array.array('l', range(self._tr_size))
+        else:
+            self._tr_size = 0
+        self._tr_index = 0
+        self._tr_count = 0
         self._prev_time = utime.ticks_us()
 
         ## Flag which is set true when the task is ready to be run by the
         #  scheduler
         self.go_flag = False
 
+        # Flag which is set while the task is parked, waiting for a call to
+        # go() from a queue or share; see park()
+        self._parked = False
+
 
     def schedule(self) -> bool:
         """!
@@ -150,75 +240,141 @@ class Task:
         @return @c True if the task ran or @c False if it did not
         """
         if self.ready():
+            self.run()
+            return True
 
-            # Reset the go flag for the next run
-            self.go_flag = False
-
-            # If profiling, save the start time
-            if self._prof:
-                stime = utime.ticks_us()
-
-            # Run the method belonging to the state which should be run next
-            curr_state = next(self._run_gen)
+        else:
+            return False
 
-            # If profiling or tracing, save timing data
-            if self._prof or self._trace:
-                etime = utime.ticks_us()
 
-            # If profiling, save timing data
-            if self._prof:
-                self._runs += 1
+    def run(self):
+        """!
+        Run the task's generator up to its next @c yield() without checking
+        whether the task is ready. This is used by @c schedule() and by
+        schedulers which have already decided that this task should run.
+        Profiling, execution budget checks and state transition tracing are
+        done here.
+        """
+        # Reset the go flag for the next run and note which task is running
+        global _current
+        self.go_flag = False
+        _current = self
+
+        # If the task is being throttled for overrunning its budget, use up
+        # this run without running the task
+        if self._hold > 0:
+            self._hold -= 1
+            self._throttled += 1
+            self._late_due = False
+            return
+
+        # If profiling or checking the budget, save the start time
+        if self._timed:
+            stime = utime.ticks_us()
+
+        # Run the method belonging to the state which should be run next
+        curr_state = next(self._run_gen)
+
+        # If timing or tracing, save timing data
+        if self._timed or self._trace:
+            etime = utime.ticks_us()
+            if self._timed:
                 runt = utime.ticks_diff(etime, stime)
-                if self._runs > 2:
-                    self._run_sum += runt
-                    if runt > self._slowest:
-                        self._slowest = runt
-
-            # If transition logic tracing is on, record a transition; if not,
-            # ignore the state. If out of memory, switch tracing off and 
-            # run the memory allocation garbage collector
-            if self._trace:
-                try:
-                    if curr_state != self._prev_state:
-                        self._tr_data.append(
-                            (utime.ticks_diff(etime, self._prev_time),
-                             curr_state))
-                except MemoryError:
-                    self._trace = False
-                    gc.collect()
-
-                self._prev_state = curr_state
-                self._prev_time = etime
 
-            return True
-
-        else:
-            return False
+        # If the task has an execution budget, see if it was overrun
+        if self._budget:
+            if runt > self._budget:
+                self._over_budget(runt)
+            else:
+                self._streak = 0
+
+        # If profiling, save timing data. Lateness is the time from the run
+        # time at which the task was released to the time it started
+        if self._prof:
+            self._runs += 1
+            if self._runs > 2:
+                self._run_sum += runt
+                if runt > self._slowest:
+                    self._slowest = runt
+                self._run_hist.add(runt)
+            if self._late_due:
+                self._late_due = False
+                late = utime.ticks_diff(stime, self._release)
+                self._late_sum += late
+                if late > self._latest:
+                    self._latest = late
+                self._late_hist.add(late)
+
+        # If transition logic tracing is on, record a transition in the ring
+        # buffers; if not, ignore the state. States which aren't integers,
+        # such as the None from a bare yield, and integers which don't fit in
+        # 32 bits are recorded as -1. The time since the last transition is
+        # kept modulo the 2**30 us ticks period, so that a state which lasts
+        # more than half the period doesn't make a negative time
+        if self._trace and curr_state != self._prev_state:
+            index = self._tr_index
+            self._tr_time[index] = utime.ticks_diff(etime,
+                                                    self._prev_time) \
+                & 0x3FFFFFFF
+            if isinstance(curr_state, int) \
+                    and -0x80000000 <= curr_state <= 0x7FFFFFFF:
+                self._tr_state[index] = curr_state
+            else:
+                self._tr_state[index] = -1
+            index += 1
+            if index >= self._tr_size:
+                index = 0
+            self._tr_index = index
+            if self._tr_count < self._tr_size:
+                self._tr_count += 1
+
+            self._prev_state = curr_state
+            self._prev_time = etime
 
 
     @micropython.native
-    def ready(self) -> bool:
+    def ready(self, now=None) -> bool:
         """!
         This method checks if the task is ready to run.
         If the task runs on a timer, this method checks what time it is; if not,
         this method checks the flag which indicates that the task is ready to
         go. This method may be overridden in descendent classes to implement
         some other behavior.
+        @param now The current time from @c utime.ticks_us(), if the caller
+               has already read the clock; if @c None, the clock is read here
         """
         # If this task uses a timer, check if it's time to run run() again. If
         # so, set go flag and set the timer to go off at the next run time
-        if self.period != None:
-            late = utime.ticks_diff(utime.ticks_us(), self._next_run)
+        if self._polled:
+            if now is None:
+                now = utime.ticks_us()
+            late = utime.ticks_diff(now, self._next_run)
             if late > 0:
-                self.go_flag = True
+                if not self._parked:
+                    self.go_flag = True
+
+                    # If keeping a latency profile, remember the run time so
+                    # that run() can find how late the task started
+                    if self._prof:
+                        self._release = self._next_run
+                        self._late_due = True
                 self._next_run = utime.ticks_diff(self.period, 
                                                   -self._next_run)
 
-                # If keeping a latency profile, record the data
-                if self._prof:
-                    self._late_sum += late
-                    if late > self._latest:
-                        self._latest = late
+                # If the next run time has also passed, periods have been
+                # missed; unless catching up, skip them and count them
+                if self._overrun != CATCH_UP:
+                    behind = utime.ticks_diff(now, self._next_run)
+                    if behind > 0:
+                        missed = (behind + self.period - 1) // self.period
+                        self._skipped += missed
+                        if self._overrun == SKIP:
+                            self._next_run = utime.ticks_add(self._next_run,
+                                missed * self.period)
+                        else:
+                            self._next_run = utime.ticks_add(now, self.period)
+
+                self._deadline = self._next_run
 
         # If the task doesn't use a timer, we rely on go_flag to signal ready
         return self.go_flag
@@ -232,9 +388,133 @@ class Task:
         @param new_period The new period in milliseconds between task runs
         """
         if new_period is None:
+            if self._timer is not None:
+                self.bind_timer(None)
             self.period = None
+            self._polled = False
         else:
+            if self.period is None:
+                self._next_run = utime.ticks_us()
+                self._deadline = self._next_run
             self.period = int(new_period) * 1000
+            if self._timer is None:
+                self._polled = True
+                self._rejoin_heap()
+            else:
+                self._timer.freq(1000000 / self.period)
+
+
+    def set_budget(self, budget, on_overrun=None, throttle_after=0,
+                   throttle_skip=1):
+        """!
+        Give the task an execution time budget, the longest time which one
+        run of the task should take.
+
+        After each run, the run time is compared with the budget. Each
+        overrun is counted, and if a callback function has been given, it is
+        called. A task which keeps overrunning its budget can be throttled:
+        after @c throttle_after overruns in a row, the task's next
+        @c throttle_skip runs are used up without running it, giving other
+        tasks their time back.
+        @param budget The budget in milliseconds, or @c None to remove it
+        @param on_overrun A function to be called as
+               @c on_overrun(task, run_time) after each overrun, with the
+               run time in microseconds, or @c None for no callback
+        @param throttle_after The number of overruns in a row after which the
+               task is throttled, or 0 never to throttle it
+        @param throttle_skip The number of runs skipped each time the task is
+               throttled
+        """
+        if budget is None:
+            self._budget = 0
+        else:
+            self._budget = max(1, int(budget * 1000))
+        self._timed = self._prof or self._budget > 0
+        self._on_overrun = on_overrun
+        self._throttle_after = throttle_after
+        self._throttle_skip = throttle_skip
+        self._hold = 0
+        self._streak = 0
+
+
+    def _over_budget(self, runt):
+        """!
+        Count a run which went over the task's execution budget, call the
+        overrun callback, and throttle the task if it has overrun too often.
+        @param runt The run time in microseconds
+        """
+        self._overruns += 1
+        self._streak += 1
+        if self._on_overrun is not None:
+            self._on_overrun(self, runt)
+        if self._throttle_after and self._streak >= self._throttle_after:
+            self._hold = self._throttle_skip
+            self._streak = 0
+
+
+    def bind_timer(self, timer):
+        """!
+        Have a hardware timer release this periodic task instead of the
+        scheduler checking the time.
+
+        The timer's interrupt calls @c go() once per period, so the task is
+        released at exact intervals no matter how long other tasks take to
+        run. The scheduler then only needs to look for this task's go flag.
+        Lateness isn't profiled for a task which is released by a timer.
+        If the timer is removed after the task has been appended to a task
+        list, the task is put back into that list's deadline heap.
+        @param timer The number of a @c pyb.Timer which isn't used for
+               anything else, or @c None to stop using a timer and go back
+               to having the scheduler check the time
+        """
+        if self._timer is not None:
+            self._timer.callback(None)
+            self._timer.deinit()
+            self._timer = None
+
+        if timer is None:
+            if self.period != None:
+                self._next_run = utime.ticks_diff(self.period,
+                                                  -utime.ticks_us())
+                self._deadline = self._next_run
+                self._polled = True
+                self._rejoin_heap()
+        else:
+            if self.period == None:
+                raise ValueError('Only a periodic task can use a timer')
+            self._polled = False
+            self._timer = pyb.Timer(timer, freq=1000000 / self.period)
+            self._timer.callback(self._timer_cb)
+
+
+    def _rejoin_heap(self):
+        """!
+        Put this task back into the deadline heap of its task list after it
+        has gone back to being released by the scheduler. A task which is
+        still in the heap, because the scheduler hasn't yet noticed that it
+        stopped being polled, is moved to its new place instead.
+        """
+        heap = self._heap
+        if heap is None:
+            return
+        if self in heap:
+            heap.remove(self)
+            pos = len(heap) // 2
+            while pos > 0:
+                pos -= 1
+                _sift_down(heap, pos)
+        heap.append(self)
+        _sift_up(heap, len(heap) - 1)
+
+
+    def _timer_cb(self, timer):
+        """!
+        Callback run by the hardware timer interrupt to release this task.
+        @param timer The timer which caused the interrupt
+        """
+        if not self._parked:
+            self.go_flag = True
+            Task._go_pending = True
 
 
     def reset_profile(self):
@@ -247,37 +527,132 @@ class Task:
         self._slowest = 0
         self._late_sum = 0
         self._latest = 0
+        self._misses = 0
+        self._skipped = 0
+        self._overruns = 0
+        self._streak = 0
+        self._throttled = 0
+        if self._prof:
+            self._run_hist.reset()
+            self._late_hist.reset()
+
+
+    def get_percentiles(self):
+        """!
+        This method makes a line of text showing the 50th, 95th and 99th
+        percentiles of the task's run time and, for a periodic task, of its
+        lateness, in milliseconds. The percentiles come from histograms, so
+        each is rounded up to the top of a histogram bin.
+        @return A string with the percentiles, or @c None if the task isn't
+                being profiled or hasn't run
+        """
+        if not self._prof or self._run_hist.count() == 0:
+            return None
+
+        rst = f"{self.name:<16s}"
+        for fraction in (0.50, 0.95, 0.99):
+            rst += f"{(self._run_hist.percentile(fraction) / 1000.0): 10.3f}"
+        if self._late_hist.count() > 0:
+            for fraction in (0.50, 0.95, 0.99):
+                rst += \
+                    f"{(self._late_hist.percentile(fraction) / 1000.0): 10.3f}"
+        return rst
+
+
+    def get_budget(self):
+        """!
+        This method makes a line of text showing the task's execution budget
+        and how many times it has been overrun.
+        @return A string with the budget data, or @c None if the task has no
+                budget
+        """
+        if not self._budget:
+            return None
+        return f"{self.name:<16s}{(self._budget / 1000.0): 10.3f}" \
+            f"{self._overruns: 10d}{self._throttled: 10d}"
 
 
     def get_trace(self):
         """!
         This method returns a string containing the task's transition trace.
-        The trace is a set of tuples, each of which contains a time and the
-        states from and to which the system transitioned. 
+        The trace shows the most recent transitions, each with a time and the
+        states from and to which the system transitioned. Times are measured
+        from the creation of the task or, once old transitions have been
+        overwritten, from the oldest transition which is still in the trace.
         @return A possibly quite large string showing state transitions
         """
         tr_str = 'Task ' + self.name + ':'
         if self._trace:
             tr_str += '\n'
-            last_state = 0
+            last_state = 0 if self._tr_count < self._tr_size else None
             total_time = 0.0
-            for item in self._tr_data:
-                total_time += item[0] / 1000000.0
-                tr_str += '{: 12.6f}: {: 2d} -> {:d}\n'.format (total_time, 
-                    last_state, item[1])
-                last_state = item[1]
+            index = self._tr_index - self._tr_count
+            if index < 0:
+                index += self._tr_size
+            for count in range(self._tr_count):
+                if last_state is not None:
+                    total_time += self._tr_time[index] / 1000000.0
+                    tr_str += '{: 12.6f}: {: 2d} -> {:d}\n'.format (
+                        total_time, last_state, self._tr_state[index])
+                last_state = self._tr_state[index]
+                index += 1
+                if index >= self._tr_size:
+                    index = 0
         else:
             tr_str += ' not traced'
         return tr_str
 
 
+    def get_trace_bytes(self):
+        """!
+        This method returns the task's transition trace in a compact binary
+        form which can be sent to a PC for analysis. The trace holds the
+        most recent transitions, oldest first, each as a little-endian
+        unsigned 32-bit time in microseconds since the previous transition
+        followed by a signed 32-bit state number.
+        @return A @c bytearray of eight bytes per transition, empty if the
+                task isn't traced
+        """
+        out = bytearray(8 * self._tr_count)
+        index = self._tr_index - self._tr_count
+        if index < 0:
+            index += self._tr_size
+        pos = 0
+        for count in range(self._tr_count):
+            struct.pack_into('<Il', out, pos, self._tr_time[index],
+                             self._tr_state[index])
+            pos += 8
+            index += 1
+            if index >= self._tr_size:
+                index = 0
+        return out
+
+
     def go(self):
         """!
         Method to set a flag so that this task indicates that it's ready to run.
         This method may be called from an interrupt service routine or from
         another task which has data that this task needs to process soon.
+        If the task is parked, this wakes it up.
         """
         self.go_flag = True
+        self._parked = False
+        Task._go_pending = True
+
+
+    def park(self):
+        """!
+        Method to stop this task from running until its @c go() method is
+        called. A parked task isn't run, even if it's periodic and its run
+        time comes; when @c go() is called, it runs once as soon as possible
+        and then goes back to its usual schedule.
+
+        This is used by queues and shares to let a task wait for data or for
+        room without spinning in a loop, which would stop every other task in
+        a cooperative system. See @c task_share.Queue.wait_any().
+        """
+        self._parked = True
+        self.go_flag = False
 
 
     def __repr__(self):
@@ -299,9 +674,85 @@ class Task:
             rst += f"{avg_dur: 10.3f}{(self._slowest / 1000.0): 10.3f}"
             if self.period != None:
                 rst += f"{avg_late: 10.3f}{(self._latest / 1000.0): 10.3f}"
+                rst += f"{self._misses: 8d}{self._skipped: 8d}"
         return rst
 
 
+# =============================================================================
+
+@micropython.native
+def _sift_up(heap, pos):
+    """!
+    Move the task at index @c pos of a deadline heap toward the top until its
+    parent's next run time is no later than its own. Times are compared with
+    @c utime.ticks_diff() so that the heap keeps working when the microsecond
+    timer wraps around.
+    @param heap A list of periodic tasks kept in heap order by @c _next_run
+    @param pos The index of the task which may be out of place
+    """
+    task = heap[pos]
+    while pos > 0:
+        parent = (pos - 1) >> 1
+        if utime.ticks_diff(task._next_run, heap[parent]._next_run) >= 0:
+            break
+        heap[pos] = heap[parent]
+        pos = parent
+    heap[pos] = task
+
+
+@micropython.native
+def _sift_down(heap, pos):
+    """!
+    Move the task at index @c pos of a deadline heap away from the top until
+    neither of its children is due to run earlier than it is.
+    @param heap A list of periodic tasks kept in heap order by @c _next_run
+    @param pos The index of the task which may be out of place
+    """
+    length = len(heap)
+    task = heap[pos]
+    child = 2 * pos + 1
+    while child < length:
+        right = child + 1
+        if right < length and utime.ticks_diff(heap[right]._next_run,
+                                               heap[child]._next_run) < 0:
+            child = right
+        if utime.ticks_diff(heap[child]._next_run, task._next_run) >= 0:
+            break
+        heap[pos] = heap[child]
+        pos = child
+        child = 2 * pos + 1
+    heap[pos] = task
+
+
+@micropython.native
+def _release_due(level, now):
+    """!
+    Release each periodic task in one priority's deadline heap whose run time
+    has passed. The task's @c ready() method sets its go flag and moves its
+    next run time forward, after which the task is moved down to its new place
+    in the heap. A task which has been released but hasn't run yet stops the
+    search so that it's released only once per run, as it would be by
+    @c TaskList.pri_sched().
+    @param level An entry in @c TaskList._dl_list
+    @param now The current time from @c utime.ticks_us()
+    """
+    heap = level[1]
+    while heap and not heap[0].go_flag \
+            and utime.ticks_diff(now, heap[0]._next_run) > 0:
+        task = heap[0]
+        if not task._polled:
+            # This task is no longer released on a time basis by the
+            # scheduler; take it off the heap
+            last = heap.pop()
+            if heap:
+                heap[0] = last
+                _sift_down(heap, 0)
+        else:
+            task.ready(now)
+            _sift_down(heap, 0)
+        level[2] = True
+
+
 # =============================================================================
 
 class TaskList:
@@ -316,7 +767,11 @@ class TaskList:
     The task list is sorted by priority so that the scheduler can efficiently
     look through the list to find the highest priority task which is ready to
     run at any given time. Tasks can also be scheduled in a simpler
-    "round-robin" fashion.
+    "round-robin" fashion. The deadline scheduler @c dl_sched() runs tasks
+    by priority as @c pri_sched() does, but it keeps periodic tasks in heaps
+    ordered by run time so it doesn't have to check every task on each call.
+    The earliest-deadline-first scheduler @c edf_sched() runs whichever ready
+    task's deadline comes first.
     """
 
     def __init__(self):
@@ -330,6 +785,23 @@ class TaskList:
         #  that priority. 
         self.pri_list = []
 
+        # The list used by the deadline scheduler @c dl_sched(). It holds one
+        # entry for each priority, sorted from highest priority down; each
+        # entry is [priority, heap, maybe_ready, pri_list entry] where heap is
+        # a list of the periodic tasks at that priority kept in heap order by
+        # next run time, and maybe_ready is set when a task at that priority
+        # may have its go flag set
+        self._dl_list = []
+
+        ## The time in microseconds before a task is due below which
+        #  @c idle_sched() stops idling the CPU and waits with
+        #  @c utime.sleep_us() instead. It should be a bit more than the time
+        #  between SysTick interrupts, which wake the CPU every millisecond
+        self.idle_margin = 1100
+
+        # Totals of time spent idle and busy in idle_sched()
+        self.reset_idle()
+
 
     def append(self, task):
         """!
@@ -352,10 +824,24 @@ class TaskList:
         # round-robin scheduling those tasks) as the second item, and tasks
         # after those
         else:
-            self.pri_list.append([new_pri, 2, task])
+            pri = [new_pri, 2, task]
+            self.pri_list.append(pri)
+            self._dl_list.append([new_pri, [], True, pri])
 
         # Make sure the main list (of lists at each priority) is sorted
         self.pri_list.sort(key=lambda pri: pri[0], reverse=True)
+        self._dl_list.sort(key=lambda level: level[0], reverse=True)
+
+        # Periodic tasks also go into the deadline heap for their priority
+        for level in self._dl_list:
+            if level[0] == new_pri:
+                heap = level[1]
+                task._heap = heap
+                if task._polled:
+                    heap.append(task)
+                    _sift_up(heap, len(heap) - 1)
+                level[2] = True
+                break
 
 
     @micropython.native
@@ -403,19 +889,280 @@ class TaskList:
                     return
 
 
+    @micropython.native
+    def dl_sched(self):
+        """!
+        Run tasks according to their priorities, using deadline heaps to find
+        tasks which are ready.
+
+        Like @c pri_sched(), this scheduler runs the highest priority task
+        which is ready, but it doesn't ask every task whether it's ready.
+        Within a priority, periodic tasks are released in order of their run
+        times, and a task which has been released but hasn't run yet holds
+        back the others at its priority which are due after it, whereas
+        @c pri_sched() goes round robin. The two run tasks in the same order
+        only when at most one task at each priority is due at a time. The
+        clock is read
+        only once per call, and the periodic tasks at each priority are kept
+        in a heap sorted by next run time, so only tasks whose run time has
+        passed are looked at. Go flags set by @c Task.go() are checked only
+        after some task's @c go() method has been called. When nothing is ready
+        to run, the cost of a call depends on the number of priorities in use
+        and not on the number of tasks. 
+
+        @b Note: The heaps are built by @c append(). A task which goes back
+        to being released on a time basis after it has been appended, through
+        @c Task.set_period() or @c Task.bind_timer(None), is put back into
+        its heap.
+        @return @c True if a task ran or @c False if no task was ready
+        """
+        now = utime.ticks_us()
+
+        # If any task's go() method has been called, every priority must be
+        # searched for go flags
+        if Task._go_pending:
+            Task._go_pending = False
+            for level in self._dl_list:
+                level[2] = True
+
+        # Go down the list of priorities, beginning with the highest
+        for level in self._dl_list:
+            # Release each periodic task at this priority which is due
+            _release_due(level, now)
+
+            # Run the next task at this priority whose go flag is set, in
+            # round-robin order as pri_sched() does
+            if level[2]:
+                pri = level[3]
+                tries = 2
+                length = len(pri)
+                while tries < length:
+                    task = pri[pri[1]]
+                    tries += 1
+                    pri[1] += 1
+                    if pri[1] >= length:
+                        pri[1] = 2
+                    if task.go_flag:
+                        task.run()
+                        return True
+
+                # No task at this priority has its go flag set
+                level[2] = False
+
+        return False
+
+
+    @micropython.native
+    def edf_sched(self):
+        """!
+        Run the ready task with the earliest deadline, ignoring priorities
+        except to break ties.
+
+        This earliest-deadline-first scheduler finds every task which is ready
+        to run in the same way as @c dl_sched(), then runs the one whose
+        deadline comes first. The deadline of a periodic task is the end of
+        the period in which it was released. A task without a period, or
+        which is released by a hardware timer, has no deadline kept by the
+        scheduler; when its @c go() method has been called, it is treated as
+        being due immediately. If two ready tasks have the same
+        deadline, the one with the higher priority is run. 
+
+        Each task counts its deadline misses, which happen when a task
+        finishes running after its deadline. Under overload, every task is delayed a little rather than
+        low priority tasks being starved.
+        @return @c True if a task ran or @c False if no task was ready
+        """
+        now = utime.ticks_us()
+
+        if Task._go_pending:
+            Task._go_pending = False
+            for level in self._dl_list:
+                level[2] = True
+
+        # Find the ready task with the earliest deadline at any priority
+        best = None
+        best_dl = now
+        for level in self._dl_list:
+            _release_due(level, now)
+
+            if level[2]:
+                pri = level[3]
+                found = False
+                index = 2
+                length = len(pri)
+                while index < length:
+                    task = pri[index]
+                    index += 1
+                    if task.go_flag:
+                        found = True
+                        if not task._polled or task._deadline is None:
+                            deadline = now
+                        else:
+                            deadline = task._deadline
+                        if best is None \
+                                or utime.ticks_diff(deadline, best_dl) < 0:
+                            best = task
+                            best_dl = deadline
+                if not found:
+                    level[2] = False
+
+        if best is None:
+            return False
+
+        best.run()
+        if best._polled \
+                and utime.ticks_diff(utime.ticks_us(), best_dl) > 0:
+            best._misses += 1
+        return True
+
+
+    def next_wake(self, now):
+        """!
+        Find how long it will be until the deadline scheduler has a task to
+        run. Only the first task in each priority's deadline heap needs to be
+        checked. Tasks which are run by @c go() can't be predicted, so they
+        aren't counted unless one of them is already waiting to run.
+        @param now The current time from @c utime.ticks_us()
+        @return The number of microseconds until a task is due to run, zero
+                if a task may be ready now, or @c None if no periodic tasks
+                are in the list
+        """
+        if Task._go_pending:
+            return 0
+
+        wait = None
+        for level in self._dl_list:
+            if level[2]:
+                return 0
+            heap = level[1]
+            if heap:
+                # A task is released once its run time has been passed
+                until = utime.ticks_diff(heap[0]._next_run, now) + 1
+                if until <= 0:
+                    return 0
+                if wait is None or until < wait:
+                    wait = until
+        return wait
+
+
+    def idle_sched(self):
+        """!
+        Run one task using @c dl_sched(), or if no task is ready, put the CPU
+        to sleep until the next task is due to run.
+
+        This scheduler is called in a loop just as @c pri_sched() is, but it
+        doesn't spin the CPU while waiting for the next task. While waiting it
+        calls @c machine.idle(), which sleeps until the next interrupt. The
+        SysTick interrupt wakes the CPU every millisecond, and any interrupt
+        service routine which calls a task's @c go() method ends the wait
+        early. The last part of the wait, shorter than @c idle_margin, is
+        timed with @c utime.sleep_us() so that tasks don't start late. The
+        time spent running tasks and the time spent idle are added up; see
+        @c idle_fraction().
+        @return @c True if a task ran or @c False if the CPU was idled
+        """
+        start = utime.ticks_us()
+        if self.dl_sched():
+            self._busy_us += utime.ticks_diff(utime.ticks_us(), start)
+            return True
+
+        # Nothing is ready, so sleep until the next task is due or until an
+        # interrupt calls some task's go() method
+        now = utime.ticks_us()
+        self._busy_us += utime.ticks_diff(now, start)
+        wait = self.next_wake(now)
+        if wait is None:
+            # Only go() can make a task ready; wait for interrupts
+            while not Task._go_pending:
+                machine.idle()
+        elif wait > 0:
+            wake = utime.ticks_add(now, wait)
+            while not Task._go_pending \
+                    and utime.ticks_diff(wake, utime.ticks_us()) \
+                        > self.idle_margin:
+                machine.idle()
+            wait = utime.ticks_diff(wake, utime.ticks_us())
+            if wait > 0 and not Task._go_pending:
+                utime.sleep_us(wait)
+        self._idle_us += utime.ticks_diff(utime.ticks_us(), now)
+        return False
+
+
+    def idle_fraction(self):
+        """!
+        Find the fraction of time which @c idle_sched() has spent with the CPU
+        idle rather than running tasks or looking for tasks to run.
+        @return The idle fraction from 0.0 to 1.0, or @c None if
+                @c idle_sched() hasn't been used
+        """
+        total = self._idle_us + self._busy_us
+        if total <= 0:
+            return None
+        return self._idle_us / total
+
+
+    def reset_idle(self):
+        """!
+        Reset the totals of idle and busy time kept by @c idle_sched().
+        This method is also used by @c __init__() to create the variables.
+        """
+        self._idle_us = 0
+        self._busy_us = 0
+
+
     def __repr__(self):
         """!
         Create some diagnostic text showing the tasks in the task list.
         """
         ret_str = 'TASK             PRI    PERIOD    RUNS   AVG DUR   MAX ' \
-            'DUR  AVG LATE  MAX LATE\n'
+            'DUR  AVG LATE  MAX LATE  MISSES SKIPPED\n'
         for pri in self.pri_list:
             for task in pri[2:]:
                 ret_str += str(task) + '\n'
 
+        # Show run time and lateness percentiles for tasks being profiled
+        pct_str = ''
+        for pri in self.pri_list:
+            for task in pri[2:]:
+                line = task.get_percentiles()
+                if line is not None:
+                    pct_str += line + '\n'
+        if pct_str:
+            ret_str += '\nTASK             DUR P50   DUR P95   DUR P99  LATE P50' \
+                '  LATE P95  LATE P99\n' + pct_str
+
+        # Show execution budgets and overruns for tasks which have budgets
+        bud_str = ''
+        for pri in self.pri_list:
+            for task in pri[2:]:
+                line = task.get_budget()
+                if line is not None:
+                    bud_str += line + '\n'
+        if bud_str:
+            ret_str += '\nTASK                BUDGET  OVERRUNS THROTTLED\n' \
+                + bud_str
+
+        idle = self.idle_fraction()
+        if idle is not None:
+            ret_str += 'IDLE {: 5.1f}% of {:.3f} s\n'.format(idle * 100.0,
+                (self._idle_us + self._busy_us) / 1000000.0)
+
         return ret_str
 
 
+def current_task():
+    """!
+    Find which task is running. A task's generator can call this function to
+    get a reference to its own @c Task object, for example to pass to
+    @c task_share.Queue.wait_any(). 
+    @return The task which was most recently run by a scheduler
+    """
+    return _current
+
+
+# The task which is running or which ran most recently
+_current = None
+
 ## This is @b the main task list which is created for scheduling when 
 #  @c cotask.py is imported into a program. 
 task_list = TaskList()
@@ -0,0 +1,249 @@
+"""!
+@file cotask_bench.py
+This file measures how much CPU time the scheduler in @c cotask.py takes.
+
+It runs on a PC under ordinary Python, using @c host_shim.py in place of the
+MicroPython modules. The virtual clock decides when tasks are due, while the
+time taken by the scheduler itself is measured with the PC's own clock. Each
+benchmark is run for 1 to 1000 tasks spread over several priorities, with
+profiling and tracing on and off, and the results are printed or saved as
+JSON. Results can be compared with a saved baseline; any benchmark which has
+become slower than the baseline by more than a given fraction is reported as
+a regression and the program exits with status 1.
+
+The numbers are only meaningful relative to each other and to a baseline made
+on the same PC, but because the same Python code runs on the pyboard, a
+scheduler change which is slower here will almost always be slower there too.
+
+Usage:
+  @code
+      python cotask_bench.py --save baseline.json
+      python cotask_bench.py --baseline baseline.json --tolerance 0.2
+  @endcode
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import host_shim
+clock = host_shim.install ()
+
+import cotask                          # Must be imported after install ()
+
+
+## The numbers of tasks for which each scheduler is measured
+TASK_COUNTS = (1, 10, 100, 1000)
+
+## The number of priority levels over which tasks are spread
+PRIORITIES = 4
+
+## The period of every task in the benchmarks, in milliseconds
+PERIOD_MS = 10
+
+
+def _task_fun (counter):
+    """!
+    Task which does nothing but count its runs. It switches between states
+    0 and 1 so that, when tracing is on, every run records a transition.
+    @param counter A one-item list which holds the number of runs
+    """
+    while True:
+        counter[0] += 1
+        yield counter[0] & 1
+
+
+def _make_list (num_tasks, profile, trace, counter):
+    """!
+    Create a task list holding a number of identical periodic tasks spread
+    over the priority levels, with run times spread evenly over the period.
+    The first task is due at once, so that tasks start to run on the first
+    call to the scheduler whatever the number of tasks.
+    @param num_tasks The number of tasks to create
+    @param profile @c True to turn on profiling in each task
+    @param trace @c True to turn on state tracing in each task
+    @param counter A one-item list in which the tasks count their runs
+    @return The new task list
+    """
+    task_list = cotask.TaskList ()
+    for index in range (num_tasks):
+        task = cotask.Task (_task_fun, name = 'T' + str (index),
+                            priority = index % PRIORITIES, period = PERIOD_MS,
+                            profile = profile, trace = trace,
+                            shares = counter)
+        task._next_run = host_shim.ticks_add (clock.ticks_us (),
+                                index * PERIOD_MS * 1000 // num_tasks)
+        task._deadline = task._next_run
+        task_list.append (task)
+    return task_list
+
+
+def bench_sched (sched, num_tasks, profile, trace, calls):
+    """!
+    Measure one scheduling method of @c cotask.TaskList. Between calls the
+    virtual clock is moved forward so that, on average, one task becomes
+    due per call, as it would in a steadily loaded system.
+    @param sched The name of the scheduling method, such as @c 'pri_sched'
+    @param num_tasks The number of tasks in the list
+    @param profile @c True to turn on profiling in each task
+    @param trace @c True to turn on state tracing in each task
+    @param calls The number of times to call the scheduling method
+    @return A tuple of the number of tasks run and the time taken in seconds
+    """
+    counter = [0]
+    task_list = _make_list (num_tasks, profile, trace, counter)
+    scheduler = getattr (task_list, sched)
+    step = max (1, PERIOD_MS * 1000 // num_tasks)
+    advance = clock.advance
+
+    start = time.perf_counter ()
+    for count in range (calls):
+        advance (step)
+        scheduler ()
+    elapsed = time.perf_counter () - start
+    return counter[0], elapsed
+
+
+def bench_ready (calls):
+    """!
+    Measure @c Task.ready() for a periodic task which isn't due yet, which
+    is what the scheduler finds most of the time.
+    @param calls The number of times to call @c ready()
+    @return A tuple of 0 tasks run and the time taken in seconds
+    """
+    task = cotask.Task (_task_fun, period = PERIOD_MS, shares = [0])
+    ready = task.ready
+    start = time.perf_counter ()
+    for count in range (calls):
+        ready ()
+    return 0, time.perf_counter () - start
+
+
+def bench_schedule (profile, trace, calls):
+    """!
+    Measure @c Task.schedule() for a task which is due every time it's
+    called, so each call runs the task.
+    @param profile @c True to turn on profiling
+    @param trace @c True to turn on state tracing
+    @param calls The number of times to call @c schedule()
+    @return A tuple of the number of runs and the time taken in seconds
+    """
+    counter = [0]
+    task = cotask.Task (_task_fun, period = PERIOD_MS, profile = profile,
+                        trace = trace, shares = counter)
+    schedule = task.schedule
+    advance = clock.advance
+    step = PERIOD_MS * 1000
+    start = time.perf_counter ()
+    for count in range (calls):
+        advance (step)
+        schedule ()
+    return counter[0], time.perf_counter () - start
+
+
+def _result (name, calls, runs, elapsed):
+    """!
+    Make a dictionary holding the results of one benchmark.
+    @param name The name of the benchmark
+    @param calls The number of calls which were timed
+    @param runs The number of task runs (dispatches) during those calls
+    @param elapsed The time taken in seconds
+    @return A dictionary of results
+    """
+    return {'name': name,
+            'calls': calls,
+            'dispatches': runs,
+            'us_per_call': elapsed * 1e6 / calls,
+            'us_per_dispatch': elapsed * 1e6 / runs if runs else None,
+            'dispatches_per_s': runs / elapsed if elapsed > 0 else None}
+
+
+def run_all (calls):
+    """!
+    Run every benchmark.
+    @param calls The number of scheduler calls in each benchmark
+    @return A list of result dictionaries
+    """
+    results = []
+
+    runs, elapsed = bench_ready (calls)
+    results.append (_result ('Task.ready', calls, runs, elapsed))
+
+    for profile, trace in ((False, False), (True, False), (True, True)):
+        options = '/prof={:d}/trace={:d}'.format (profile, trace)
+        runs, elapsed = bench_schedule (profile, trace, calls)
+        results.append (_result ('Task.schedule' + options, calls, runs,
+                                 elapsed))
+
+        for sched in ('pri_sched', 'rr_sched', 'dl_sched', 'edf_sched'):
+            for num_tasks in TASK_COUNTS:
+                runs, elapsed = bench_sched (sched, num_tasks, profile,
+                                             trace, calls)
+                name = 'TaskList.{:s}/n={:d}{:s}'.format (sched, num_tasks,
+                                                          options)
+                results.append (_result (name, calls, runs, elapsed))
+    return results
+
+
+def compare (results, baseline, tolerance):
+    """!
+    Compare results with a baseline and find regressions.
+    @param results A list of result dictionaries from @c run_all()
+    @param baseline A list of result dictionaries from an earlier run
+    @param tolerance The fraction by which the time per call may grow before
+           it's counted as a regression
+    @return A list of (name, baseline time, new time) tuples, one for each
+            regression, with times in microseconds per call
+    """
+    old = {item['name']: item for item in baseline}
+    regressions = []
+    for item in results:
+        before = old.get (item['name'])
+        if before is None:
+            continue
+        if item['us_per_call'] > before['us_per_call'] * (1.0 + tolerance):
+            regressions.append ((item['name'], before['us_per_call'],
+                                 item['us_per_call']))
+    return regressions
+
+
+def main ():
+    """!
+    Run the benchmarks, print or save the results, and check for regressions.
+    @return The program's exit status, 1 if there are regressions
+    """
+    parser = argparse.ArgumentParser (description = __doc__.split ('\n')[2])
+    parser.add_argument ('--calls', type = int, default = 5000,
+                         help = 'scheduler calls per benchmark')
+    parser.add_argument ('--save', help = 'save results to this JSON file')
+    parser.add_argument ('--baseline', help = 'compare with this JSON file')
+    parser.add_argument ('--tolerance', type = float, default = 0.25,
+                         help = 'allowed slowdown as a fraction, default 0.25')
+    args = parser.parse_args ()
+
+    report = {'python': sys.version.split ()[0],
+              'results': run_all (args.calls)}
+
+    if args.save:
+        with open (args.save, 'w') as out_file:
+            json.dump (report, out_file, indent = 1)
+    else:
+        json.dump (report, sys.stdout, indent = 1)
+        print ()
+
+    if args.baseline:
+        with open (args.baseline) as in_file:
+            baseline = json.load (in_file)['results']
+        regressions = compare (report['results'], baseline, args.tolerance)
+        for name, before, after in regressions:
+            print ('REGRESSION {:s}: {:.3f} -> {:.3f} us/call'.format (
+                   name, before, after), file = sys.stderr)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit (main ())
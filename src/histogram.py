@@ -0,0 +1,116 @@
+"""!
+@file histogram.py
+This file contains a class which keeps a histogram of times or other
+non-negative integers in a fixed amount of memory, so that percentiles of
+the values can be found without storing the values themselves.
+
+The bins of the histogram are on a logarithmic scale. Values from 0 to 7 each
+have their own bin; above that, each doubling of the value is split into four
+bins, so a value is known to within 25 percent. The memory for the bins
+is allocated when the histogram is created, and adding a value doesn't
+allocate any memory, so histograms can be filled inside a task's run or an
+interrupt service routine.
+"""
+
+import array
+import micropython
+
+
+class Histogram:
+    """!
+    A fixed size histogram of non-negative integers with logarithmic bins.
+
+    Example:
+      @code
+          run_times = histogram.Histogram ()
+          run_times.add (utime.ticks_diff (end, start))
+          ...
+          print (run_times.percentile (0.99))
+      @endcode
+    """
+
+    def __init__ (self, num_bins = 96):
+        """!
+        Create a histogram and allocate memory for its bins.
+        @param num_bins The number of bins. Values too large for the last bin
+               are counted in the last bin. The default of 96 bins holds
+               values up to about 33 million, which is 33 seconds if the
+               values are in microseconds
+        """
+        self._num_bins = num_bins
+        self._bins = array.array ('L', range (num_bins))
+        self.reset ()
+
+
+    @micropython.native
+    def add (self, value):
+        """!
+        Count one value in the histogram.
+        @param value The value, an integer; negative values are counted as 0
+        """
+        if value < 8:
+            if value < 0:
+                value = 0
+            index = value
+        else:
+            # Shift the value down until it's 4 to 7; the shift count gives
+            # the power of two and the value what quarter of that power
+            shift = 0
+            while value >= 8:
+                value >>= 1
+                shift += 1
+            index = 4 * shift + value
+            if index >= self._num_bins:
+                index = self._num_bins - 1
+        self._bins[index] += 1
+        self._count += 1
+
+
+    def bin_limit (self, index):
+        """!
+        Find the largest value which is counted in a given bin.
+        @param index The number of the bin
+        @return The largest value counted in that bin
+        """
+        index += 1
+        if index < 8:
+            return index - 1
+        return ((index % 4 + 4) << (index // 4 - 1)) - 1
+
+
+    def percentile (self, fraction):
+        """!
+        Find a value which is at least as large as a given fraction of the
+        values in the histogram. Because values are counted in bins, the
+        result is the largest value in the bin where that fraction is reached.
+        @param fraction The fraction of values, for example 0.95 for the 95th
+               percentile
+        @return The percentile value, or @c None if the histogram is empty
+        """
+        if self._count <= 0:
+            return None
+        needed = fraction * self._count
+        total = 0
+        for index in range (self._num_bins):
+            total += self._bins[index]
+            if total >= needed and total > 0:
+                return self.bin_limit (index)
+        return self.bin_limit (self._num_bins - 1)
+
+
+    def count (self):
+        """!
+        Find the number of values which have been counted.
+        @return The number of values in the histogram
+        """
+        return self._count
+
+
+    def reset (self):
+        """!
+        Empty the histogram. This method is also used by @c __init__() to
+        clear the bins.
+        """
+        for index in range (self._num_bins):
+            self._bins[index] = 0
+        self._count = 0
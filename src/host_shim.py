@@ -0,0 +1,363 @@
+"""!
+@file host_shim.py
+This file lets @c cotask.py and @c task_share.py run under ordinary Python
+on a PC, using a virtual clock in place of the microcontroller's timer.
+
+The MicroPython modules @c utime, @c pyb, @c machine and @c micropython don't
+exist on a PC, so this file creates stand-ins for the parts of them which the
+scheduler and the shares use. Time doesn't pass by itself on the virtual
+clock; it moves forward when a task says how long it took, when the scheduler
+sleeps, or when @c run() finds that nothing is ready and skips ahead to the
+next task's run time. Hours of scheduling can be replayed in seconds, and the
+results are the same every time, which makes timing behavior testable.
+
+Example:
+  @code
+      import host_shim
+      clock = host_shim.install ()
+
+      import cotask                  # Must be imported after install ()
+
+      def task_fun ():
+          while True:
+              clock.advance (150)    # Pretend that each run takes 150 us
+              yield 0
+
+      cotask.task_list.append (cotask.Task (task_fun, period = 20,
+                                            profile = True))
+      host_shim.run (cotask.task_list, 3600000)     # One hour
+      print (cotask.task_list)
+  @endcode
+
+@b Note: On the microcontroller this file isn't needed and shouldn't be
+imported.
+"""
+
+import sys
+import types
+
+
+## The number of microseconds after which @c utime.ticks_us() wraps around to
+#  zero, as it does on the pyboard
+TICKS_PERIOD = 1 << 30
+
+# Half of the ticks period, used to give ticks differences their signs
+_TICKS_HALF = TICKS_PERIOD // 2
+
+
+class VirtualClock:
+    """!
+    A monotonic microsecond clock which only moves when told to.
+
+    The clock keeps an unbounded count of microseconds; the @c ticks_us()
+    values seen by the scheduler are taken from it modulo @c TICKS_PERIOD,
+    so a clock started near the end of the ticks period can be used to test
+    timer wraparound.
+    """
+
+    def __init__ (self, start_us = 0):
+        """!
+        Create a virtual clock.
+        @param start_us The time in microseconds at which the clock starts
+        """
+        ## The current time in microseconds. It never wraps around.
+        self.now_us = start_us
+
+        ## The number of times the CPU was idled by @c machine.idle() or
+        #  @c pyb.wfi()
+        self.idles = 0
+
+        # Simulated hardware timers which have callbacks, each of which is
+        # called when the clock passes the timer's next tick
+        self._timers = []
+
+
+    def advance (self, delta_us):
+        """!
+        Move the clock forward. Tasks call this to say how long they take.
+        Callbacks of simulated timers which tick in the meantime are run at
+        their tick times, as interrupts would be.
+        @param delta_us The number of microseconds by which to move the clock
+        """
+        if delta_us > 0:
+            self.advance_to (self.now_us + int (delta_us))
+
+
+    def advance_to (self, time_us):
+        """!
+        Move the clock forward to a given time, if that time is in the future,
+        running the callbacks of any simulated timers which tick on the way.
+        @param time_us The time in microseconds, as given by @c now_us
+        """
+        time_us = int (time_us)
+        while True:
+            timer = self._next_timer ()
+            if timer is None or timer._next_tick > time_us:
+                break
+            if timer._next_tick > self.now_us:
+                self.now_us = timer._next_tick
+            timer._tick ()
+        if time_us > self.now_us:
+            self.now_us = time_us
+
+
+    def idle (self):
+        """!
+        Model @c machine.idle() on the pyboard, which sleeps until the next
+        interrupt. The SysTick interrupt happens every millisecond, so the
+        clock moves forward to the next whole millisecond or to the next
+        tick of a simulated timer, whichever comes first.
+        """
+        self.idles += 1
+        wake = self.now_us + 1000 - self.now_us % 1000
+        timer = self._next_timer ()
+        if timer is not None and timer._next_tick < wake:
+            wake = timer._next_tick
+        self.advance_to (wake)
+
+
+    def next_event (self):
+        """!
+        Find when the next simulated timer interrupt will happen.
+        @return The time in microseconds of the next timer tick which has a
+                callback, or @c None if no timers have callbacks
+        """
+        timer = self._next_timer ()
+        return None if timer is None else timer._next_tick
+
+
+    def _next_timer (self):
+        """!
+        Find the simulated timer which will tick next.
+        @return The timer, or @c None if no timers have callbacks
+        """
+        first = None
+        for timer in self._timers:
+            if first is None or timer._next_tick < first._next_tick:
+                first = timer
+        return first
+
+
+    def ticks_us (self):
+        """!
+        Get the time as @c utime.ticks_us() would give it.
+        @return The time in microseconds modulo @c TICKS_PERIOD
+        """
+        return self.now_us % TICKS_PERIOD
+
+
+class Timer:
+    """!
+    Stand-in for @c pyb.Timer which runs on the virtual clock.
+
+    Only the timer's frequency and callback are simulated. The callback is
+    run at each tick of the timer, as an interrupt service routine would be,
+    whenever the virtual clock is moved past that tick. Ticks happen at exact
+    multiples of the period after the timer's frequency was set, rounded to
+    the nearest microsecond.
+    """
+
+    def __init__ (self, num, freq = None, callback = None, **kwargs):
+        """!
+        Create a simulated timer.
+        @param num The timer number, kept only for printouts
+        @param freq The frequency in Hz at which the timer ticks
+        @param callback A function to be called with the timer as its
+               parameter each time the timer ticks
+        @param kwargs Other parameters of @c pyb.Timer, which are ignored
+        """
+        self._num = num
+        self._callback = None
+        self._period_us = None
+        self._next_tick = None
+        if freq is not None:
+            self.freq (freq)
+        self.callback (callback)
+
+
+    def freq (self, value = None):
+        """!
+        Get or set the timer's frequency. Setting it restarts the timer.
+        @param value The new frequency in Hz, or @c None to get the frequency
+        @return The frequency in Hz if @c value is @c None
+        """
+        if value is None:
+            return 1000000.0 / self._period_us if self._period_us else None
+        self._period_us = 1000000.0 / value
+        self._start_us = clock.now_us
+        self._ticks = 0
+        self._next_tick = clock.now_us + int (round (self._period_us))
+
+
+    def callback (self, function):
+        """!
+        Set or remove the function which is called each time the timer ticks.
+        @param function The callback function, or @c None to remove it
+        """
+        self._callback = function
+        if function is None or self._period_us is None:
+            if self in clock._timers:
+                clock._timers.remove (self)
+        elif self not in clock._timers:
+            clock._timers.append (self)
+
+
+    def deinit (self):
+        """!
+        Stop the timer and remove its callback.
+        """
+        self.callback (None)
+        self._period_us = None
+
+
+    def _tick (self):
+        """!
+        Run the callback for the tick which is due now and work out when the
+        next tick will be.
+        """
+        self._ticks += 1
+        self._next_tick = self._start_us \
+            + int (round ((self._ticks + 1) * self._period_us))
+        self._callback (self)
+
+
+def ticks_diff (ticks1, ticks2):
+    """!
+    Find the signed difference between two ticks values, as
+    @c utime.ticks_diff() does, allowing for wraparound.
+    @param ticks1 The later ticks value
+    @param ticks2 The earlier ticks value
+    @return @c ticks1 minus @c ticks2
+    """
+    return ((ticks1 - ticks2 + _TICKS_HALF) % TICKS_PERIOD) - _TICKS_HALF
+
+
+def ticks_add (ticks, delta):
+    """!
+    Add a number to a ticks value, as @c utime.ticks_add() does.
+    @param ticks A ticks value
+    @param delta The number to add, which may be negative
+    @return The sum, wrapped around to the ticks period
+    """
+    return (ticks + delta) % TICKS_PERIOD
+
+
+def _identity (function):
+    """!
+    Stand-in for MicroPython's code emitter decorators such as
+    @c micropython.native, which do nothing on a PC.
+    """
+    return function
+
+
+## The virtual clock which is used by the stand-in modules after
+#  @c install() has been called
+clock = None
+
+
+def install (start_us = 0):
+    """!
+    Create a virtual clock and put stand-ins for the MicroPython modules
+    @c utime, @c pyb, @c machine and @c micropython into @c sys.modules.
+    This must be called before @c cotask or @c task_share is imported.
+    @param start_us The time in microseconds at which the clock starts
+    @return The virtual clock
+    """
+    global clock
+    clock = VirtualClock (start_us)
+
+    utime = types.ModuleType ('utime')
+    utime.ticks_us = clock.ticks_us
+    utime.ticks_ms = lambda: (clock.now_us // 1000) % TICKS_PERIOD
+    utime.ticks_cpu = clock.ticks_us
+    utime.ticks_diff = ticks_diff
+    utime.ticks_add = ticks_add
+    utime.sleep_us = clock.advance
+    utime.sleep_ms = lambda delay_ms: clock.advance (delay_ms * 1000)
+    utime.sleep = lambda delay_s: clock.advance (delay_s * 1000000)
+    utime.time = lambda: clock.now_us // 1000000
+
+    micropython = types.ModuleType ('micropython')
+    micropython.native = _identity
+    micropython.viper = _identity
+    micropython.const = _identity
+    micropython.alloc_emergency_exception_buf = lambda size: None
+    micropython.schedule = lambda function, arg: function (arg)
+
+    machine = types.ModuleType ('machine')
+    machine.idle = clock.idle
+
+    pyb = types.ModuleType ('pyb')
+    pyb.disable_irq = lambda: True
+    pyb.enable_irq = lambda state = True: None
+    pyb.wfi = clock.idle
+    pyb.millis = lambda: (clock.now_us // 1000) % TICKS_PERIOD
+    pyb.micros = clock.ticks_us
+    pyb.elapsed_millis = lambda start: ticks_diff (pyb.millis (), start)
+    pyb.elapsed_micros = lambda start: ticks_diff (clock.ticks_us (), start)
+    pyb.Timer = Timer
+
+    for module in (utime, micropython, machine, pyb):
+        sys.modules[module.__name__] = module
+
+    return clock
+
+
+def run (task_list, duration_ms, sched = 'dl_sched'):
+    """!
+    Run a task list on the virtual clock for a given length of virtual time.
+
+    Whenever the scheduler finds nothing to run, the clock is moved straight
+    to the time at which the next task is due, so no real time is spent
+    waiting. Tasks which don't move the clock themselves take no time.
+    @param task_list The @c cotask.TaskList whose tasks are to be run
+    @param duration_ms The length of virtual time to run, in milliseconds
+    @param sched The name of the scheduling method to call, such as
+           @c 'dl_sched', @c 'edf_sched', @c 'pri_sched' or @c 'idle_sched'
+    @return The number of times the scheduling method was called
+    """
+    scheduler = getattr (task_list, sched)
+    end_us = clock.now_us + int (duration_ms * 1000)
+    calls = 0
+    while clock.now_us < end_us:
+        ran = scheduler ()
+        calls += 1
+        if not ran:
+            # Skip ahead to the next run time. The pri_sched() and rr_sched()
+            # methods don't say whether a task ran, so if one may be ready,
+            # step just one microsecond
+            # Tasks released by simulated hardware timers are woken by the
+            # next timer tick
+            wait = _next_due (task_list, clock.ticks_us ())
+            tick = clock.next_event ()
+            if tick is not None and (wait is None
+                                     or tick - clock.now_us < wait):
+                clock.advance_to (min (tick, end_us))
+            elif wait is None:
+                clock.advance_to (end_us)
+            else:
+                clock.advance (wait if wait > 0 else 1)
+    return calls
+
+
+def _next_due (task_list, now):
+    """!
+    Find how long it will be until any task in a task list is ready to run.
+    Every task is looked at, so this works with any scheduling method.
+    @param task_list The @c cotask.TaskList whose tasks are checked
+    @param now The current time as given by @c utime.ticks_us()
+    @return The number of microseconds until a task is due to run, zero if
+            one is ready now, or @c None if no task will ever be due
+    """
+    wait = None
+    for pri in task_list.pri_list:
+        for task in pri[2:]:
+            if task.go_flag:
+                return 0
+            if task._polled:
+                until = ticks_diff (task._next_run, now) + 1
+                if wait is None or until < wait:
+                    wait = until
+    if wait is not None and wait < 0:
+        wait = 0
+    return wait
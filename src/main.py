@@ -11,8 +11,10 @@
 
 import gc
 import pyb
+import struct
 import cotask
 import task_share
+import telemetry
 from encoder_driver import EncoderDriver
 from motor_driver import MotorDriver
 from pro_control import ProControl
@@ -23,8 +25,8 @@ import random
 
 def task1_fun():
     """!@brief Task which runs the proportional controller to control the motor.
-    @details This task runs the proportional controller and sends position data over
-        UART to a C-Python program which plots the data
+    @details This task runs the proportional controller and queues position data
+        to be sent over UART to a C-Python program which plots the data
 
     """
     # Read encoder to get an initial value
@@ -39,8 +41,12 @@ def task1_fun():
         read_1,pos_1 = enc_1.update(read_1,pos_1)
         # Calculate the current time
         time_1 = (utime.ticks_diff(utime.ticks_ms(),start_1))
-        # Create function string and put in queue as bytes
-        u2.write(f"motor 1,{time_1},{pos_1}\r\n")
+        # Queue the time and position for the telemetry task to send. The
+        # record is packed into a preallocated buffer, and if the queue is
+        # full the sample is dropped rather than waiting for the UART
+        struct.pack_into(telemetry.SAMPLE_FORMAT, record_1, 0, 1, time_1,
+                         pos_1)
+        samples.put_record(record_1)
         # Calculate effort with pos and neg limits
         effort_1 = con_1.run(pos_1)
         if effort_1<-100:
@@ -54,8 +60,8 @@ def task1_fun():
         
 def task2_fun():
     """!@brief Task which runs the proportional controller to control the motor.
-    @details This task runs the proportional controller and sends position data over
-        UART to a C-Python program which plots the data
+    @details This task runs the proportional controller and queues position data
+        to be sent over UART to a C-Python program which plots the data
 
     """
     # Read encoder to get an initial value
@@ -70,8 +76,12 @@ def task2_fun():
         read_2,pos_2 = enc_2.update(read_2,pos_2)
         # Calculate the current time
         time_2 = (utime.ticks_diff(utime.ticks_ms(),start_2))
-        # Create function string and put in queue as bytes
-        u2.write(f"motor 2,{time_2},{pos_2}\r\n")
+        # Queue the time and position for the telemetry task to send. The
+        # record is packed into a preallocated buffer, and if the queue is
+        # full the sample is dropped rather than waiting for the UART
+        struct.pack_into(telemetry.SAMPLE_FORMAT, record_2, 0, 2, time_2,
+                         pos_2)
+        samples.put_record(record_2)
         # Calculate effort with pos and neg limits
         effort_2 = con_2.run(pos_2)
         if effort_2<-100:
@@ -90,19 +100,26 @@ def main():
             of both motors every few seconds. 
     """
     while True:
-        # Keep running on current gains/setpoints for 5000 cycles.
+        # Keep running on current gains/setpoints for 5 seconds.
         #This is enough that the motor positions can be played with by hand to inspect the performance
-        for n in range(0,5000):
+        #The scheduler idles the CPU between task runs, so count time rather than calls
+        start = utime.ticks_ms()
+        while utime.ticks_diff(utime.ticks_ms(), start) < 5000:
             try:
-                cotask.task_list.pri_sched()
+                cotask.task_list.idle_sched()
             except KeyboardInterrupt:
                 # If there is a keyboard interrupt, turn off the motors
                 motor_1.set_duty_cycle(0)
                 motor_2.set_duty_cycle(0)
-                # Tell the C-Python program that we are done
-                u2.write(b'end\r\n')
-                # Print exit statement
+                # Send the queued samples and tell the C-Python program that
+                # we are done
+                sender.finish()
+                # Print exit statement, the scheduler's idle time and the
+                # number of samples which couldn't be sent in time
                 print('Program exited by user')
+                print(cotask.task_list)
+                print(task_share.show_all())
+                print(f'{sender.dropped()} samples dropped')
                 # Raise exception to exit out of all loops
                 raise Exception('Program Exited by User')
                 break
@@ -146,21 +163,52 @@ if __name__ == "__main__":
     con_2.set_setpoint(2048)
     con_2.set_Kp(0.05)
     
-    # Wait for C-Python program to be ready
+    # Wait for C-Python program to be ready. It asks for binary frames by
+    # sending 'ready bin', for a compressed stream by sending 'ready delta',
+    # or for lines of text by sending 'ready'
     start = u2.readline()
-    if start != b'ready\r\n':
+    if start == b'ready\r\n':
+        mode = 'text'
+    elif start == b'ready bin\r\n':
+        mode = 'bin'
+    elif start == b'ready delta\r\n':
+        mode = 'delta'
+    else:
         raise Exception('C-python program needs to be started after this program')
+    # The control tasks put samples into a queue, packing each one into a
+    # buffer which is allocated once; a low priority task sends them in
+    # batches, so a slow link can't hold up the control loop
+    samples = task_share.RecordQueue(telemetry.SAMPLE_FORMAT, 32,
+                                     name="Samples")
+    record_1 = bytearray(telemetry.SAMPLE_SIZE)
+    record_2 = bytearray(telemetry.SAMPLE_SIZE)
+    sender = telemetry.Sender(u2, samples, mode=mode)
 
-    # Create the tasks. If trace is enabled for any task, memory will be
-    # allocated for state transition tracing, and the application will run out
-    # of memory after a while and quit. Therefore, use tracing only for 
-    # debugging and set trace to False when it's not needed
+    # Create the tasks. If trace is enabled for any task, a fixed amount of
+    # memory is allocated to hold its most recent state transitions, and
+    # tracing slows the task down slightly; set trace to False when it's not
+    # needed
     task1 = cotask.Task(task1_fun, name="Task_1", priority=1, period=20,
                         profile=False, trace=False)
     task2 = cotask.Task(task2_fun, name="Task_2", priority=1, period=20,
                         profile=False, trace=False)
+    # Release the control tasks from hardware timers 6 and 7 so that their
+    # 20 ms period doesn't depend on polling by the scheduler loop. A timer
+    # tick which comes while the task is still waiting to run just sets its
+    # go flag again, so after a stall the missed ticks merge into one run
+    task1.bind_timer(6)
+    task2.bind_timer(7)
+    # Count runs of the control tasks which take more than 2 ms; the counts
+    # are printed with the task list when the program exits
+    task1.set_budget(2)
+    task2.set_budget(2)
+    # The telemetry task runs at the lowest priority and sends at most a few
+    # samples per run, so it takes time the control tasks don't need
+    task3 = cotask.Task(sender.run, name="Telemetry", priority=0, period=10,
+                        profile=False, trace=False)
     cotask.task_list.append(task1)
     cotask.task_list.append(task2)
+    cotask.task_list.append(task3)
 
     # Run the memory garbage collector to ensure memory is as defragmented as
     # possible before the real-time scheduler is started
@@ -5,16 +5,231 @@
 """
 import serial
 from matplotlib import pyplot
+import numpy
+import sys
+import threading
 import time
+import telemetry
 
 
-def main():
+## The most samples of each motor kept for the live plot
+LIVE_SAMPLES = 5000
+
+## The most times per second the live plot is redrawn
+LIVE_FPS = 20
+
+## The length of time shown across the live plot, in milliseconds
+LIVE_WINDOW_MS = 10000
+
+
+class LineReader:
+   """!@brief Splits lines of text sent by the Nucleo into samples.
+       @details Received bytes are added to one buffer, which is kept between
+       calls. All the complete lines in the buffer are split off and parsed
+       together, and any partial line is kept until the rest of it arrives.
+       Lines which can't be parsed are counted rather than printed. The
+       samples are given in the same form as by telemetry.FrameReader, so
+       either can be used to read the data.
+   """
+
+   def __init__(self):
+       """!@brief Creates a line reader with an empty buffer.
+       """
+       self._data = bytearray()
+       ## The number of lines which weren't in the expected format
+       self.bad = 0
+
+   def feed(self, data):
+       """!@brief Adds received bytes and parses the complete lines.
+           @param data The bytes which have been received
+           @return A list of (motor, time, position) tuples, one for each
+                   good line; the line "end" gives (telemetry.END, 0, 0)
+       """
+       buffer = self._data
+       buffer += data
+       last = buffer.rfind(b'\n')
+       if last < 0:
+           return []
+       lines = buffer[:last].split(b'\n')
+       del buffer[:last + 1]
+
+       samples = []
+       for line in lines:
+           line = line.rstrip(b'\r')
+           try:
+               motor, data1, data2 = line.split(b',')
+               if not motor.startswith(b'motor '):
+                   raise ValueError
+               samples.append((int(motor[6:]), float(data1), float(data2)))
+           except ValueError:
+               if line == b'end':
+                   samples.append((telemetry.END, 0, 0))
+               elif line:
+                   self.bad += 1
+       return samples
+
+
+class RingBuffer:
+   """!@brief Keeps the most recent times and positions of one motor in
+      fixed-size NumPy arrays.
+       @details Each sample is written twice, at its place in the ring and
+       one ring's length further on, so the newest samples in order are
+       always one contiguous slice of the arrays and can be plotted without
+       copying them into place. The memory used doesn't grow however long
+       the run lasts.
+   """
+
+   def __init__(self, capacity):
+       """!@brief Allocates the arrays for a ring buffer.
+           @param capacity The most samples which are kept
+       """
+       self._capacity = capacity
+       self._times = numpy.zeros(2 * capacity)
+       self._positions = numpy.zeros(2 * capacity)
+       self._index = 0
+       self._count = 0
+
+   def append(self, time, position):
+       """!@brief Adds a sample, replacing the oldest one if the ring is full.
+           @param time The time of the sample in milliseconds
+           @param position The position in encoder counts
+       """
+       index = self._index
+       self._times[index] = self._times[index + self._capacity] = time
+       self._positions[index] = self._positions[index + self._capacity] \
+           = position
+       self._index = (index + 1) % self._capacity
+       if self._count < self._capacity:
+           self._count += 1
+
+   def view(self):
+       """!@brief Gets the samples in the ring, oldest first.
+           @return A tuple of views of the time and position arrays; they
+                   change when samples are added, so copy them if needed
+       """
+       end = self._index + self._capacity
+       start = end - self._count
+       return self._times[start:end], self._positions[start:end]
+
+
+def _read_live(s_port, reader, rings, lock, stop):
+   """!@brief Reads samples from the serial port into ring buffers until the
+      end of the data, so that reading never waits for the plot.
+       @param s_port The serial port
+       @param reader A telemetry.FrameReader or LineReader
+       @param rings A dictionary of RingBuffer objects keyed by motor number
+       @param lock A lock which is held while the rings are changed
+       @param stop An event which is set to stop reading early
+   """
+   while not stop.is_set():
+       samples = reader.feed(s_port.read(s_port.in_waiting or 1))
+       with lock:
+           for motor, data1, data2 in samples:
+               if motor == telemetry.END:
+                   return
+               if motor in rings:
+                   rings[motor].append(data1, data2)
+
+
+def live_plot(s_port, reader):
+   """!@brief Plots motor positions while they're being received.
+       @details A separate thread reads the serial port into ring buffers,
+       and this function redraws the plot from them at most LIVE_FPS times a
+       second. Only the data lines are drawn each time, over a saved copy of
+       the axes ("blitting"); the whole figure is drawn again only when the
+       axes have to move to keep the data in view or the window changes.
+       The plot keeps running after the data ends, until its window is
+       closed.
+       @param s_port The serial port, to which the ready statement has been
+              sent
+       @param reader A telemetry.FrameReader or LineReader
+   """
+   rings = {1: RingBuffer(LIVE_SAMPLES), 2: RingBuffer(LIVE_SAMPLES)}
+   lock = threading.Lock()
+   stop = threading.Event()
+   thread = threading.Thread(target=_read_live,
+                             args=(s_port, reader, rings, lock, stop),
+                             daemon=True)
+   thread.start()
+
+   fig, ax = pyplot.subplots()
+   lines = {1: ax.plot([], [], 'g-', label="Motor_1", animated=True)[0],
+            2: ax.plot([], [], 'r-', label="Motor_2", animated=True)[0]}
+   ax.set_xlabel("Time [ms]")
+   ax.set_ylabel("Position [enc counts]")
+   ax.legend()
+   ax.set_xlim(0, LIVE_WINDOW_MS)
+   ax.set_ylim(-100, 100)
+
+   # Save the empty axes each time the figure is fully drawn
+   background = [None]
+   def save_background(event):
+       background[0] = fig.canvas.copy_from_bbox(fig.bbox)
+   fig.canvas.mpl_connect('draw_event', save_background)
+   pyplot.show(block=False)
+   fig.canvas.draw()
+
+   frame_time = 1.0 / LIVE_FPS
+   while pyplot.fignum_exists(fig.number):
+       start = time.perf_counter()
+       with lock:
+           data = {motor: tuple(array.copy() for array in ring.view())
+                   for motor, ring in rings.items()}
+
+       # Move the axes if the data has run off them
+       newest = max((times[-1] for times, positions in data.values()
+                     if len(times)), default=None)
+       if newest is not None:
+           x_min, x_max = ax.get_xlim()
+           y_min, y_max = ax.get_ylim()
+           low = min(positions.min() for times, positions in data.values()
+                     if len(positions))
+           high = max(positions.max() for times, positions in data.values()
+                      if len(positions))
+           redraw = False
+           if newest > x_max:
+               ax.set_xlim(newest - 0.75 * LIVE_WINDOW_MS,
+                           newest + 0.25 * LIVE_WINDOW_MS)
+               redraw = True
+           if low < y_min or high > y_max:
+               margin = 0.1 * (high - low) + 1
+               ax.set_ylim(min(low, y_min) - margin, max(high, y_max) + margin)
+               redraw = True
+           if redraw:
+               fig.canvas.draw()
+
+       # Draw only the lines over the saved axes
+       fig.canvas.restore_region(background[0])
+       for motor, line in lines.items():
+           line.set_data(*data[motor])
+           ax.draw_artist(line)
+       fig.canvas.blit(fig.bbox)
+       fig.canvas.flush_events()
+
+       # Keep to the frame rate, leaving the CPU to the reading thread
+       rest = frame_time - (time.perf_counter() - start)
+       if rest > 0:
+           time.sleep(rest)
+
+   stop.set()
+   thread.join()
+   if reader.bad:
+       print(f"{reader.bad} corrupt frames or lines")
+
+
+def main(mode='bin', live=False):
    """!@brief This is the main function which passes data to the micropython
       device. 
        @details This function uses the pyserial module to communicate over the
        serial port to the micropython. The function sends a setpoint and gain
        to the Nucleo and waits for the return data which represents the motor
        response. The data is then plotted and displayed.
+       @param mode 'bin' to ask for binary frames or 'delta' for a compressed
+              stream, both decoded by telemetry.FrameReader, or 'text' to
+              ask for lines of text, which are parsed by a LineReader
+       @param live True to plot the data while it's received, keeping only
+              the most recent samples, or False to plot all the data at the
+              end
    """
     
    m1_x_list = []
@@ -24,45 +239,40 @@ def main():
 
    with serial.Serial('COM4', 115200,timeout = 3) as s_port:
        #
-       # send ready statement
-       s_port.write(b'ready\r\n')
-       
-       while True:
-           sline = s_port.readline()
-           print(sline)
-           if sline==b'end\r\n':
-               break
-        
-           try:
-                motor, data1, data2 = sline.split(b',')
-                data2 = data2.split(b'\r')[0]
-                d1stat, d2stat = True, True
-                
-                try:
-                    data1 = float(data1)
-                except (ValueError):
-                    d1stat = False
-                    print("Data in column 1 is corrupt")
-                
-                try:
-                    data2 = float(data2)
-                except(ValueError):
-                    d2stat = False
-                    print("Data in column 2 is corrupt")
-
-                if (d1stat and d2stat):
-                    if motor == b'motor 1':
-                        m1_x_list.append(data1)
-                        m1_y_list.append(data2)
-                    elif motor == b'motor 2':
-                        m2_x_list.append(data1)
-                        m2_y_list.append(data2)
-           except:
-                # line not formatted correctly
-                print("list is not in the expected format")
-                
-            
-            
+       # send ready statement, which tells the Nucleo how to send its data
+       if mode == 'text':
+           s_port.write(b'ready\r\n')
+           reader = LineReader()
+       else:
+           s_port.write(b'ready ' + mode.encode() + b'\r\n')
+           reader = telemetry.FrameReader()
+
+       if live:
+           live_plot(s_port, reader)
+           return
+
+       # Read whatever has arrived in one piece, waiting for at least one
+       # byte, and parse all the samples in it
+       done = False
+       while not done:
+           samples = reader.feed(s_port.read(s_port.in_waiting or 1))
+           for motor, data1, data2 in samples:
+               if motor == 1:
+                   m1_x_list.append(data1)
+                   m1_y_list.append(data2)
+               elif motor == 2:
+                   m2_x_list.append(data1)
+                   m2_y_list.append(data2)
+               elif motor == telemetry.END:
+                   done = True
+                   break
+
+       if mode == 'text':
+           if reader.bad:
+               print(f"{reader.bad} lines were not in the expected format")
+       elif reader.bad or reader.lost:
+           print(f"{reader.bad} corrupt frames, {reader.lost} frames lost")
+
        pyplot.plot(m1_x_list, m1_y_list, 'go-',label="Motor_1")
        pyplot.plot(m2_x_list, m2_y_list, 'ro-',label="Motor_2")
        pyplot.xlabel("Time [ms]")
@@ -77,4 +287,10 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    live = '--live' in sys.argv
+    if '--text' in sys.argv:
+        main('text', live)
+    elif '--delta' in sys.argv:
+        main('delta', live)
+    else:
+        main('bin', live)
\ No newline at end of file
@@ -24,8 +24,11 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import array
 import gc
+import struct
 import pyb
+import utime
 import micropython
+from histogram import Histogram        # Times with interrupts disabled
 
 
 ## This is a system-wide list of all the queues and shared variables. It is
@@ -48,6 +51,56 @@ def show_all ():
     @return A string containing information about each queue and share
     """
     gen = (str (item) for item in share_list)
+    text = '\n'.join (gen)
+
+    # If interrupts-off times have been measured, add a table of them
+    timed = [item for item in share_list if item._irq_hist is not None]
+    if timed:
+        text += '\n\n{:<12s} {:>8s} {:>7s} {:>7s} {:>7s}'.format (
+                'IRQ off, us', 'Count', 'Max', '50%', '99%')
+        for item in timed:
+            hist = item._irq_hist
+            count = hist.count ()
+            text += '\n{:<12s} {:>8d} {:>7d} {:>7s} {:>7s}'.format (
+                    item._name, count, item._irq_max,
+                    str (hist.percentile (0.5)) if count else '-',
+                    str (hist.percentile (0.99)) if count else '-')
+    return text
+
+
+def time_irq_off (on = True):
+    """!
+    Turn on or off the measurement of how long interrupts are disabled by
+    every queue and share which exists now. See @c BaseShare.time_irq_off().
+    @param on @c True to start measuring, @c False to stop
+    """
+    for item in share_list:
+        item.time_irq_off (on)
+
+
+## The names of the comma separated fields in each line of @c snapshot()
+SNAPSHOT_FIELDS = 'name,puts,gets,drops,wait_us,num_in,window_max,max_full,size'
+
+
+def snapshot (new_window = True):
+    """!
+    Create a compact, machine readable record of the counters of each queue
+    and share in the system, suitable for sending to a PC during a run.
+    Each line holds the fields named in @c SNAPSHOT_FIELDS, separated by
+    commas. The counts of puts, gets, drops and the microseconds spent
+    waiting are totals since the queue or share was created, modulo 2**30,
+    so a PC can find rates from the differences between two snapshots,
+    taken modulo 2**30. The window
+    maximum is the most items held since the last snapshot which started a
+    new window:
+    @code
+    |   u2.write (task_share.snapshot ())
+    |   u2.write ('\\r\\n')
+    @endcode
+    @param new_window @c True to start a new window for the high-water marks
+    @return A string with one line for each queue and share
+    """
+    gen = (item.metrics_line (new_window) for item in share_list)
     return '\n'.join (gen)
 
 
@@ -71,10 +124,216 @@ class BaseShare:
         self._type_code = type_code
         self._thread_protect = thread_protect
 
+        # Tasks which are parked waiting to get data from or put data into
+        # this queue or share, and the times at which they started to wait.
+        # One task can wait in each direction
+        self._getter = None
+        self._putter = None
+        self._get_since = 0
+        self._put_since = 0
+
+        # Tasks which are woken every time data is put in. This is a tuple
+        # so that it can be looped through in an interrupt without
+        # allocating memory
+        self._subscribers = ()
+
+        # Counters which are shown by metrics(): items put in, items taken
+        # out, items dropped or overwritten, and the time which tasks spent
+        # waiting to get or put data. The sizes are set by queues. The
+        # counters wrap around at 2**30, as Broadcast._count does, because
+        # some are updated in interrupts, where a bigger integer can't be
+        # allocated
+        self._puts = 0
+        self._gets = 0
+        self._drops = 0
+        self._wait_us = 0
+        self._win_max = 0
+        self._max_full = 0
+        self._size = 0
+
+        # A histogram of the times in microseconds for which interrupts were
+        # disabled by this queue or share, and the longest such time. The
+        # histogram is made only if the times are to be measured
+        self._irq_hist = None
+        self._irq_max = 0
+
         # Add this queue to the global share and queue list
         share_list.append (self)
 
 
+    def _park (self, task, getter):
+        """!
+        Park a task until data is put into this queue or share or, for a
+        queue, until data is taken out of it. If another task was already
+        waiting in the same direction, that task is woken so that it isn't
+        left parked for good; it will check again and park itself again if
+        it still has to wait.
+        @param task The @c cotask.Task which is to wait
+        @param getter @c True to wait for data to be put in, @c False to wait
+               for data to be taken out
+        """
+        task.park ()
+        now = utime.ticks_us ()
+        if getter:
+            other = self._getter
+            self._getter = task
+            if other is not task:
+                since = self._get_since
+                self._get_since = now
+        else:
+            other = self._putter
+            self._putter = task
+            if other is not task:
+                since = self._put_since
+                self._put_since = now
+        if other is not None and other is not task:
+            self._wait_us = (self._wait_us + utime.ticks_diff (
+                now, since)) & 0x3FFFFFFF
+            other.go ()
+
+
+    def add_subscriber (self, task):
+        """!
+        Have a task woken, by a call to its @c go() method, every time data
+        is put into this queue or share. This lets a task which has no period
+        run as soon as there's new data, rather than polling for it:
+        @code
+        |   def consumer_task (shares):
+        |       my_queue = shares
+        |       while True:
+        |           while my_queue.any ():
+        |               do_something_with (my_queue.get ())
+        |           yield 0
+        |
+        |   consumer = cotask.Task (consumer_task, priority=2, period=None,
+        |                           shares=my_queue)
+        |   my_queue.add_subscriber (consumer)
+        @endcode
+        A periodic task which subscribes also runs early whenever data is put
+        in, then goes back to its usual schedule.
+        @param task The @c cotask.Task to be woken
+        """
+        if task not in self._subscribers:
+            self._subscribers = self._subscribers + (task,)
+
+
+    def remove_subscriber (self, task):
+        """!
+        Stop waking a task when data is put into this queue or share.
+        @param task A @c cotask.Task which was given to @c add_subscriber()
+        """
+        self._subscribers = tuple (item for item in self._subscribers
+                                   if item is not task)
+
+
+    @micropython.native
+    def _wake_getter (self):
+        """!
+        Wake the task, if any, which is waiting for data to be put in, and
+        the tasks which have subscribed to this queue or share.
+        """
+        task = self._getter
+        if task is not None:
+            self._getter = None
+            self._wait_us = (self._wait_us + utime.ticks_diff (
+                utime.ticks_us (), self._get_since)) & 0x3FFFFFFF
+            task.go ()
+        for task in self._subscribers:
+            task.go ()
+
+
+    @micropython.native
+    def _wake_putter (self):
+        """!
+        Wake the task, if any, which is waiting for data to be taken out.
+        """
+        task = self._putter
+        if task is not None:
+            self._putter = None
+            self._wait_us = (self._wait_us + utime.ticks_diff (
+                utime.ticks_us (), self._put_since)) & 0x3FFFFFFF
+            task.go ()
+
+
+    def time_irq_off (self, on = True):
+        """!
+        Turn on or off the measurement of how long this queue or share keeps
+        interrupts disabled while it moves data. The time of each critical
+        section, from just after interrupts are disabled to just after they
+        are enabled again, is counted in a histogram, and the longest time is
+        kept; they're shown by @c task_share.show_all(). Measuring adds a
+        few microseconds to each put and get. Only queues and shares with
+        thread protection disable interrupts, and not when called with
+        @c in_ISR set to @c True.
+        @param on @c True to start measuring, @c False to stop
+        """
+        if on:
+            if self._irq_hist is None:
+                self._irq_hist = Histogram ()
+            else:
+                self._irq_hist.reset ()
+            self._irq_max = 0
+        else:
+            self._irq_hist = None
+
+
+    @micropython.native
+    def _irq_off_time (self, start):
+        """!
+        Count the time for which interrupts were disabled in a critical
+        section which has just ended.
+        @param start The time, from @c utime.ticks_us(), at which interrupts
+               were disabled
+        """
+        duration = utime.ticks_diff (utime.ticks_us (), start)
+        if duration > self._irq_max:
+            self._irq_max = duration
+        self._irq_hist.add (duration)
+
+
+    def _level (self):
+        """!
+        Find how many items are held, for @c metrics(). Queues override this.
+        @return The number of items held
+        """
+        return 0
+
+
+    def metrics (self, new_window = False):
+        """!
+        Get the counters which show how much this queue or share has been
+        used. The counts are totals since it was created, which wrap around
+        to 0 at 2**30 so that they never need a long integer; the window
+        maximum is the most items held since the last call which started a
+        new window. Items are counted as dropped when they're overwritten, or
+        when they aren't put in because a queue was full and couldn't wait.
+        For a share which isn't a queue, the fill and size are 0.
+        @param new_window @c True to start a new window for the window
+               maximum after reading it
+        @return A tuple of the numbers of puts, gets and drops, the total
+                time in microseconds which tasks spent waiting, the number of
+                items held now, the window maximum, the all time maximum and
+                the size
+        """
+        level = self._level ()
+        win_max = self._win_max
+        if new_window:
+            self._win_max = level
+        return (self._puts, self._gets, self._drops, self._wait_us, level,
+                win_max, self._max_full, self._size)
+
+
+    def metrics_line (self, new_window = False):
+        """!
+        Put the name and counters of this queue or share into one line of
+        comma separated values, in the order given by @c SNAPSHOT_FIELDS.
+        @param new_window @c True to start a new window for the window maximum
+        @return A string holding the values
+        """
+        return self._name + ',' + ','.join (str (value) for value
+                                            in self.metrics (new_window))
+
+
 # ============================================================================
 
 class Queue (BaseShare):
@@ -105,7 +364,7 @@ class Queue (BaseShare):
     ser_num = 0
 
     def __init__ (self, type_code, size, thread_protect = False, 
-                  overwrite = False, name = None):
+                  overwrite = False, name = None, buffer = None):
         """!
         Initialize a queue object to carry and buffer data between tasks.
 
@@ -132,7 +391,9 @@ class Queue (BaseShare):
                data if the queue becomes full 
         @param name A short name for the queue, default @c QueueN where @c N
                is a serial number for the queue
-
+        @param buffer A @c memoryview of @c size items of type @c type_code,
+               usually given by an @c Arena, or @c None to allocate memory
+               for the queue here
         """
         # First call the parent class initializer
         super ().__init__ (type_code, thread_protect, name)
@@ -143,22 +404,44 @@ class Queue (BaseShare):
             else 'Queue' + str (Queue.ser_num)
         Queue.ser_num += 1
 
-        # Allocate memory in which the queue's data will be stored
-        try:
-            self._buffer = array.array (type_code, range (size))
-        except MemoryError:
-            self._buffer = None
-            raise
-        except ValueError:
-            self._buffer = None
-            raise
+        # Allocate memory in which the queue's data will be stored, unless it
+        # was allocated by an arena
+        if buffer is not None:
+            self._buffer = buffer
+        else:
+            try:
+                self._buffer = array.array (type_code, range (size))
+            except MemoryError:
+                self._buffer = None
+                raise
+            except ValueError:
+                self._buffer = None
+                raise
+
+        # A view of the buffer through which slices are copied by put_many()
+        # and get_many() without making temporary copies, and the number of
+        # elements of the view taken up by each item
+        self._view = memoryview (self._buffer)
+        self._width = 1
 
         # Initialize pointers to be used for reading and writing data
         self.clear ()
 
         # Since we may have allocated a bunch of memory, call the garbage
-        # collector to neaten up what memory is left for future use
-        gc.collect ()
+        # collector to neaten up what memory is left for future use. An arena
+        # does this once after it has made all its queues and shares
+        if buffer is None:
+            gc.collect ()
+
+
+    @staticmethod
+    def _needs (type_code, size, *args, **kwargs):
+        """!
+        Find how much memory an @c Arena must set aside for a queue. The
+        parameters are the same as those of the constructor.
+        @return A tuple of the type code and number of items of memory needed
+        """
+        return type_code, size
 
 
     @micropython.native
@@ -168,10 +451,12 @@ class Queue (BaseShare):
 
         If there isn't room for the item, wait (blocking the calling process)
         until room becomes available, unless the @c overwrite constructor
-        parameter was set to @c True to allow old data to be clobbered. If
-        non-blocking behavior without overwriting is needed, one should call
+        parameter was set to @c True to allow old data to be clobbered. 
+        @b Note: In a cooperative multitasking system, such a wait would stop
+        every task, including the one which would take data out of the queue.
+        If non-blocking behavior without overwriting is needed, one should call
         @c full() to ensure that the queue is not full before putting data
-        into it:
+        into it, or use @c wait_room():
         @code
         |   def some_task ():
         |       # Setup
@@ -183,20 +468,33 @@ class Queue (BaseShare):
         @param item The item to be placed into the queue
         @param in_ISR Set this to @c True if calling from within an ISR
         """
-        # If we're in an ISR and the queue is full and we're not allowed to
-        # overwrite data, we have to give up and exit
-        if self.full ():
+        # If the queue is full and we're not allowed to overwrite data, we
+        # have to wait for room or, in an ISR, give up and count a drop
+        if self.full () and not self._overwrite:
             if in_ISR:
+                self._drops = (self._drops + 1) & 0x3FFFFFFF
                 return
 
-            # Wait (if needed) until there's room in the buffer for the data
-            if not self._overwrite:
-                while self.full ():
-                    pass
+            # Wait until there's room in the buffer for the data
+            start = utime.ticks_us ()
+            while self.full ():
+                pass
+            self._wait_us = (self._wait_us + utime.ticks_diff (
+                utime.ticks_us (), start)) & 0x3FFFFFFF
 
         # Prevent data corruption by blocking interrupts during data transfer
         if self._thread_protect and not in_ISR:
             _irq_state = pyb.disable_irq ()
+            if self._irq_hist is not None:
+                irq_start = utime.ticks_us ()
+
+        # If the queue is full, the oldest item is dropped to make room
+        if self._num_items >= self._size:
+            self._rd_idx += 1
+            if self._rd_idx >= self._size:
+                self._rd_idx = 0
+            self._num_items -= 1
+            self._drops = (self._drops + 1) & 0x3FFFFFFF
 
         # Write the data and advance the counts and pointers
         self._buffer[self._wr_idx] = item
@@ -204,14 +502,20 @@ class Queue (BaseShare):
         if self._wr_idx >= self._size:
             self._wr_idx = 0
         self._num_items += 1
-        if self._num_items >= self._size:        # Can't be fuller than full
-            self._num_items = self._size
+        self._puts = (self._puts + 1) & 0x3FFFFFFF
         if self._num_items > self._max_full:     # Record maximum fillage
             self._max_full = self._num_items
+        if self._num_items > self._win_max:
+            self._win_max = self._num_items
 
         # Re-enable interrupts
         if self._thread_protect and not in_ISR:
             pyb.enable_irq (_irq_state)
+            if self._irq_hist is not None:
+                self._irq_off_time (irq_start)
+
+        # If a task is waiting for data, wake it
+        self._wake_getter ()
 
 
     @micropython.native
@@ -222,7 +526,8 @@ class Queue (BaseShare):
         If there isn't anything in there, wait (blocking the calling process)
         until something becomes available. If non-blocking reads are needed,
         one should call @c any() to check for items before attempting to read
-        from the queue. This is usually done in a low priority task:
+        from the queue, or use @c wait_any() to park the task until data
+        arrives. Checking is usually done in a low priority task:
         @code
         |   def some_task ():
         |       # Setup
@@ -236,12 +541,18 @@ class Queue (BaseShare):
         @param in_ISR Set this to @c True if calling from within an ISR
         """
         # Wait until there's something in the queue to be returned
-        while self.empty ():
-            pass
+        if self._num_items <= 0:
+            start = utime.ticks_us ()
+            while self.empty ():
+                pass
+            self._wait_us = (self._wait_us + utime.ticks_diff (
+                utime.ticks_us (), start)) & 0x3FFFFFFF
 
         # Prevent data corruption by blocking interrupts during data transfer
         if self._thread_protect and not in_ISR:
             irq_state = pyb.disable_irq ()
+            if self._irq_hist is not None:
+                irq_start = utime.ticks_us ()
 
         # Get the item to be returned from the queue
         to_return = self._buffer[self._rd_idx]
@@ -253,14 +564,243 @@ class Queue (BaseShare):
         self._num_items -= 1
         if self._num_items < 0:
             self._num_items = 0
+        self._gets = (self._gets + 1) & 0x3FFFFFFF
 
         # Re-enable interrupts
         if self._thread_protect and not in_ISR:
             pyb.enable_irq (irq_state)
+            if self._irq_hist is not None:
+                self._irq_off_time (irq_start)
+
+        # If a task is waiting for room, wake it
+        self._wake_putter ()
 
         return (to_return)
 
 
+    @micropython.native
+    def put_many (self, items, in_ISR = False):
+        """!
+        Put a group of items into the queue with one call.
+
+        The items are copied into the queue's buffer as at most two slices,
+        one up to the end of the buffer and one from its beginning, with
+        interrupts disabled once for the whole group if thread protection is
+        on. This method never waits. If there isn't room for all the items,
+        as many as fit are put in, unless the @c overwrite constructor
+        parameter was set to @c True, in which case the oldest data is
+        overwritten to make room for all of them.
+        @code
+        |   samples = array.array ('h', range (32))
+        |   ...
+        |   n_put = my_queue.put_many (samples)
+        @endcode
+        @param items An @c array.array or @c memoryview holding items of the
+               same type code as the queue
+        @param in_ISR Set this to @c True if calling from within an ISR
+        @return The number of items taken from @c items
+        """
+        src = memoryview (items)
+        width = self._width
+        total = len (src) // width
+        start = 0
+
+        # Prevent data corruption by blocking interrupts during data transfer
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+            if self._irq_hist is not None:
+                irq_start = utime.ticks_us ()
+
+        count = total
+        free = self._size - self._num_items
+        if count > free:
+            if self._overwrite:
+                # Only the newest items which fit in the buffer are kept, and
+                # the oldest items in the queue are dropped to make room
+                if count > self._size:
+                    start = count - self._size
+                    count = self._size
+                dropped = count - free
+                self._rd_idx += dropped
+                if self._rd_idx >= self._size:
+                    self._rd_idx -= self._size
+                self._num_items -= dropped
+                self._drops = (self._drops + dropped + start) & 0x3FFFFFFF
+            else:
+                self._drops = (self._drops + count - free) & 0x3FFFFFFF
+                count = free
+                total = free
+
+        # Copy the items up to the end of the buffer, then any remaining ones
+        # to the beginning of the buffer
+        wr_idx = self._wr_idx
+        first = self._size - wr_idx
+        if first > count:
+            first = count
+        self._view[wr_idx * width:(wr_idx + first) * width] = \
+            src[start * width:(start + first) * width]
+        if count > first:
+            self._view[0:(count - first) * width] = \
+                src[(start + first) * width:(start + count) * width]
+        wr_idx += count
+        if wr_idx >= self._size:
+            wr_idx -= self._size
+        self._wr_idx = wr_idx
+
+        self._num_items += count
+        self._puts = (self._puts + count) & 0x3FFFFFFF
+        if self._num_items > self._max_full:     # Record maximum fillage
+            self._max_full = self._num_items
+        if self._num_items > self._win_max:
+            self._win_max = self._num_items
+
+        # Re-enable interrupts
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+            if self._irq_hist is not None:
+                self._irq_off_time (irq_start)
+
+        if count > 0:
+            self._wake_getter ()
+        return total
+
+
+    @micropython.native
+    def get_many (self, buf, in_ISR = False):
+        """!
+        Read a group of items from the queue with one call.
+
+        As many items as are in the queue, up to the length of @c buf, are
+        copied into @c buf as at most two slices, with interrupts disabled
+        once for the whole group if thread protection is on. This method
+        never waits; it returns 0 if the queue is empty.
+        @code
+        |   chunk = array.array ('h', range (32))
+        |   ...
+        |   n_got = my_queue.get_many (chunk)
+        |   for index in range (n_got):
+        |       do_something_with (chunk[index])
+        @endcode
+        @param buf An @c array.array or @c memoryview of the same type code
+               as the queue, into which items are copied
+        @param in_ISR Set this to @c True if calling from within an ISR
+        @return The number of items copied into @c buf
+        """
+        dst = memoryview (buf)
+        width = self._width
+
+        # Prevent data corruption by blocking interrupts during data transfer
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+            if self._irq_hist is not None:
+                irq_start = utime.ticks_us ()
+
+        count = len (dst) // width
+        if count > self._num_items:
+            count = self._num_items
+
+        # Copy items up to the end of the buffer, then any remaining ones
+        # from the beginning of the buffer
+        rd_idx = self._rd_idx
+        first = self._size - rd_idx
+        if first > count:
+            first = count
+        dst[0:first * width] = \
+            self._view[rd_idx * width:(rd_idx + first) * width]
+        if count > first:
+            dst[first * width:count * width] = \
+                self._view[0:(count - first) * width]
+        rd_idx += count
+        if rd_idx >= self._size:
+            rd_idx -= self._size
+        self._rd_idx = rd_idx
+        self._num_items -= count
+        self._gets = (self._gets + count) & 0x3FFFFFFF
+
+        # Re-enable interrupts
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+            if self._irq_hist is not None:
+                self._irq_off_time (irq_start)
+
+        if count > 0:
+            self._wake_putter ()
+        return count
+
+
+    def wait_any (self, task):
+        """!
+        Make a task wait, without blocking other tasks, until there's data in
+        the queue.
+
+        If the queue holds any data, this method returns @c False at once.
+        Otherwise it parks the task, which then won't be run until something
+        is put into the queue, and returns @c True; the task should then
+        yield. A task uses this method in a loop:
+        @code
+        |   def consumer_task (shares):
+        |       my_queue = shares
+        |       me = cotask.current_task ()
+        |       while True:
+        |           while my_queue.wait_any (me):
+        |               yield 0
+        |           do_something_with (my_queue.get ())
+        |           yield 1
+        @endcode
+        Only one task can wait for data in each queue at a time. A task which
+        has no period must be started with a call to its @c go() method so
+        that it can run far enough to park itself; after that, it's kept
+        ready to run for as long as the queue holds data.
+        @param task The task which is running, usually found with
+               @c cotask.current_task()
+        @return @c True if the task has been parked and should yield
+        """
+        if self._num_items > 0:
+            if task.period is None:
+                task.go ()
+            return False
+        self._park (task, True)
+
+        # If an interrupt put data in just before the task was parked, wake
+        # the task so that it runs again as soon as it has yielded
+        if self._num_items > 0:
+            self._wake_getter ()
+        return True
+
+
+    def wait_room (self, task):
+        """!
+        Make a task wait, without blocking other tasks, until there's room in
+        the queue for more data.
+
+        If the queue isn't full, or if old data may be overwritten, this
+        method returns @c False at once. Otherwise it parks the task, which
+        then won't be run until something is taken out of the queue, and
+        returns @c True; the task should then yield:
+        @code
+        |   while my_queue.wait_room (me):
+        |       yield 0
+        |   my_queue.put (something)
+        @endcode
+        Only one task can wait for room in each queue at a time. A task which
+        has no period is kept ready to run for as long as there's room.
+        @param task The task which is running, usually found with
+               @c cotask.current_task()
+        @return @c True if the task has been parked and should yield
+        """
+        if self._overwrite or self._num_items < self._size:
+            if task.period is None:
+                task.go ()
+            return False
+        self._park (task, False)
+
+        # If an interrupt took data out just before the task was parked, wake
+        # the task so that it runs again as soon as it has yielded
+        if self._num_items < self._size:
+            self._wake_putter ()
+        return True
+
+
     @micropython.native
     def any (self):
         """!
@@ -309,6 +849,14 @@ class Queue (BaseShare):
         return (self._num_items)
 
 
+    def _level (self):
+        """!
+        Find how many items are in the queue, for @c metrics().
+        @return The number of items in the queue
+        """
+        return self._num_items
+
+
     def clear (self):
         """!
         Remove all contents from the queue.
@@ -317,6 +865,7 @@ class Queue (BaseShare):
         self._wr_idx = 0
         self._num_items = 0
         self._max_full = 0
+        self._win_max = 0
 
 
     def __repr__ (self):
@@ -330,6 +879,750 @@ class Queue (BaseShare):
                 type_code_strings[self._type_code], self._max_full, self._size))
 
 
+# ============================================================================
+
+class RecordQueue (Queue):
+    """!
+    A queue which carries records made of several fields, such as a time, a
+    motor number and a position, as one item.
+
+    The layout of each record is given by a format string as used by the
+    @c struct module. Records are packed into one @c bytearray which is
+    allocated when the queue is created, so putting and getting records
+    doesn't allocate memory for the data. Each record is put or taken as a
+    whole, with interrupts disabled if thread protection is on, so a reader
+    never sees fields from two different records.
+
+    Unlike @c Queue.put() and @c Queue.get(), the @c put() and @c get()
+    methods of this class never wait; @c put() returns @c False if the queue
+    is full and @c get() returns @c None if it's empty. The methods @c any(),
+    @c full(), @c num_in(), @c wait_any() and @c wait_room() work as they do
+    for a @c Queue.
+
+    @code
+    import task_share
+
+    # Each record holds a time (uint32), motor number (uint8), position
+    # (int32) and effort (int16)
+    samples = task_share.RecordQueue ('<IBlh', 32, name="Samples")
+
+    # In one task
+    samples.put (time, 1, position, effort)
+
+    # In another task
+    if samples.any ():
+        time, motor, position, effort = samples.get ()
+    @endcode
+    """
+    ## A counter used to give serial numbers to queues for diagnostic use.
+    ser_num = 0
+
+    def __init__ (self, fmt, size, thread_protect = False, overwrite = False,
+                  name = None, buffer = None):
+        """!
+        Initialize a record queue, allocating memory for its records.
+        @param fmt A @c struct format string giving the layout of a record
+        @param size The maximum number of records which the queue can hold
+        @param thread_protect @c True if mutual exclusion protection is used
+        @param overwrite If @c True, the oldest record will be overwritten by
+               a new one if the queue is full
+        @param name A short name for the queue, default @c RecordQueueN where
+               @c N is a serial number for the queue
+        @param buffer A @c memoryview of bytes with room for @c size records,
+               usually given by an @c Arena, or @c None to allocate memory
+               for the queue here
+        """
+        BaseShare.__init__ (self, fmt, thread_protect, name)
+
+        self._size = size
+        self._overwrite = overwrite
+        self._name = str (name) if name != None \
+            else 'RecordQueue' + str (RecordQueue.ser_num)
+        RecordQueue.ser_num += 1
+
+        # Allocate memory for the records. Bulk copies in put_many() and
+        # get_many() work in bytes, so each item is a record's size wide
+        self._rec_size = struct.calcsize (fmt)
+        if buffer is not None:
+            self._buffer = buffer
+        else:
+            self._buffer = bytearray (size * self._rec_size)
+        self._view = memoryview (self._buffer)
+        self._width = self._rec_size
+
+        self.clear ()
+        if buffer is None:
+            gc.collect ()
+
+
+    @staticmethod
+    def _needs (fmt, size, *args, **kwargs):
+        """!
+        Find how much memory an @c Arena must set aside for a record queue.
+        The parameters are the same as those of the constructor.
+        @return A tuple of the type code and number of items of memory needed
+        """
+        return 'B', size * struct.calcsize (fmt)
+
+
+    @micropython.native
+    def put (self, *values, in_ISR = False):
+        """!
+        Put a record into the queue, packing the given values into it.
+
+        If the queue is full, the record is not put in and @c False is
+        returned, unless the @c overwrite constructor parameter was set to
+        @c True, in which case the oldest record is overwritten. 
+        @b Note: Passing the values as separate arguments allocates a little
+        memory, which isn't allowed in a hard interrupt such as a timer
+        callback. An interrupt service routine should instead pack the record
+        into a @c bytearray allocated in advance, using @c struct.pack_into(),
+        and put it in with @c put_record(). Don't use @c put_many() there, as
+        the memoryviews it makes are also allocated.
+        @param values The values of the record's fields, in order
+        @param in_ISR Set this to @c True if calling from within an ISR
+        @return @c True if the record was put in, @c False if the queue was
+                full
+        """
+        if self._num_items >= self._size and not self._overwrite:
+            self._drops = (self._drops + 1) & 0x3FFFFFFF
+            return False
+
+        # Prevent data corruption by blocking interrupts during data transfer
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+            if self._irq_hist is not None:
+                irq_start = utime.ticks_us ()
+
+        # If the queue is full, the oldest record is dropped
+        if self._num_items >= self._size:
+            self._rd_idx += 1
+            if self._rd_idx >= self._size:
+                self._rd_idx = 0
+            self._num_items -= 1
+            self._drops = (self._drops + 1) & 0x3FFFFFFF
+
+        struct.pack_into (self._type_code, self._buffer,
+                          self._wr_idx * self._rec_size, *values)
+        self._wr_idx += 1
+        if self._wr_idx >= self._size:
+            self._wr_idx = 0
+        self._num_items += 1
+        self._puts = (self._puts + 1) & 0x3FFFFFFF
+        if self._num_items > self._max_full:     # Record maximum fillage
+            self._max_full = self._num_items
+        if self._num_items > self._win_max:
+            self._win_max = self._num_items
+
+        # Re-enable interrupts
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+            if self._irq_hist is not None:
+                self._irq_off_time (irq_start)
+
+        self._wake_getter ()
+        return True
+
+
+    @micropython.native
+    def put_record (self, record, in_ISR = False):
+        """!
+        Put a record which has already been packed into the queue.
+
+        The record's bytes are copied one at a time into the queue's buffer,
+        so unlike @c put() and @c put_many() this method doesn't allocate any
+        memory and can be used in a hard interrupt or in a task which runs
+        very often. Full queues are handled as by @c put().
+        @code
+        |   record = bytearray (samples.record_size ())
+        |   ...
+        |   struct.pack_into ('<IBlh', record, 0, time, 1, position, effort)
+        |   samples.put_record (record)
+        @endcode
+        @param record A @c bytearray or @c bytes object holding one record
+               packed in the queue's format
+        @param in_ISR Set this to @c True if calling from within an ISR
+        @return @c True if the record was put in, @c False if the queue was
+                full
+        """
+        if self._num_items >= self._size and not self._overwrite:
+            self._drops = (self._drops + 1) & 0x3FFFFFFF
+            return False
+
+        # Prevent data corruption by blocking interrupts during data transfer
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+            if self._irq_hist is not None:
+                irq_start = utime.ticks_us ()
+
+        # If the queue is full, the oldest record is dropped
+        if self._num_items >= self._size:
+            self._rd_idx += 1
+            if self._rd_idx >= self._size:
+                self._rd_idx = 0
+            self._num_items -= 1
+            self._drops = (self._drops + 1) & 0x3FFFFFFF
+
+        buffer = self._buffer
+        offset = self._wr_idx * self._rec_size
+        index = 0
+        while index < self._rec_size:
+            buffer[offset + index] = record[index]
+            index += 1
+        self._wr_idx += 1
+        if self._wr_idx >= self._size:
+            self._wr_idx = 0
+        self._num_items += 1
+        self._puts = (self._puts + 1) & 0x3FFFFFFF
+        if self._num_items > self._max_full:     # Record maximum fillage
+            self._max_full = self._num_items
+        if self._num_items > self._win_max:
+            self._win_max = self._num_items
+
+        # Re-enable interrupts
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+            if self._irq_hist is not None:
+                self._irq_off_time (irq_start)
+
+        self._wake_getter ()
+        return True
+
+
+    @micropython.native
+    def get (self, in_ISR = False):
+        """!
+        Take the oldest record out of the queue.
+        @param in_ISR Set this to @c True if calling from within an ISR
+        @return A tuple of the record's field values, or @c None if the queue
+                is empty
+        """
+        if self._num_items <= 0:
+            return None
+
+        # Prevent data corruption by blocking interrupts during data transfer
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+            if self._irq_hist is not None:
+                irq_start = utime.ticks_us ()
+
+        to_return = struct.unpack_from (self._type_code, self._buffer,
+                                        self._rd_idx * self._rec_size)
+        self._rd_idx += 1
+        if self._rd_idx >= self._size:
+            self._rd_idx = 0
+        self._num_items -= 1
+        self._gets = (self._gets + 1) & 0x3FFFFFFF
+
+        # Re-enable interrupts
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+            if self._irq_hist is not None:
+                self._irq_off_time (irq_start)
+
+        self._wake_putter ()
+        return to_return
+
+
+    def record_size (self):
+        """!
+        Find the size of one record in bytes. Buffers given to @c put_many()
+        and @c get_many() hold whole records packed one after another, so
+        their sizes should be multiples of this.
+        @return The number of bytes in a record
+        """
+        return self._rec_size
+
+
+    def __repr__ (self):
+        """!
+        This method puts diagnostic information about the queue into a string,
+        showing its name, record format, maximum fill and size.
+        """
+        return ('{:<12s} RecordQueue<{:s}> Max Full {:d}/{:d}'.format (
+                self._name, self._type_code, self._max_full, self._size))
+
+
+# ============================================================================
+
+class SPSCQueue (BaseShare):
+    """!
+    A queue with one writer and one reader which never disables interrupts.
+
+    This queue is meant for sending data from one interrupt service routine
+    to one task, or from one task to another. The writer changes only the
+    write index and the reader changes only the read index, and each index is
+    changed only after the data it covers has been written or read, so the
+    two sides can't corrupt each other's data even if one interrupts the
+    other. No interrupts are disabled, so using this queue doesn't add any
+    latency to other interrupts. If the queue is full, new data is dropped
+    and the number of items dropped is counted.
+
+    Only one piece of code may put data into the queue and only one may take
+    data out of it; for more writers or readers, use a @c Queue with thread
+    protection.
+
+    @code
+    import task_share
+
+    # This queue holds up to 64 signed 32-bit encoder readings
+    enc_queue = task_share.SPSCQueue ('l', 64, name="Encoder")
+
+    # In an interrupt service routine
+    enc_queue.put (encoder_timer.counter ())
+
+    # In a task
+    while enc_queue.any ():
+        reading = enc_queue.get ()
+    @endcode
+    """
+    ## A counter used to give serial numbers to queues for diagnostic use.
+    ser_num = 0
+
+    def __init__ (self, type_code, size, name = None, buffer = None):
+        """!
+        Initialize a single-producer, single-consumer queue.
+        @param type_code The type of data items which the queue can hold,
+               given as for a @c Queue
+        @param size The maximum number of items which the queue can hold
+        @param name A short name for the queue, default @c SPSCQueueN where
+               @c N is a serial number for the queue
+        @param buffer A @c memoryview of @c size + 1 items of type
+               @c type_code, usually given by an @c Arena, or @c None to
+               allocate memory for the queue here
+        """
+        super ().__init__ (type_code, False, name)
+
+        # The buffer has one spare slot so that a full queue and an empty one
+        # can be told apart using only the two indices
+        self._size = size
+        self._slots = size + 1
+        if buffer is not None:
+            self._buffer = buffer
+        else:
+            self._buffer = array.array (type_code, range (self._slots))
+        self._name = str (name) if name != None \
+            else 'SPSCQueue' + str (SPSCQueue.ser_num)
+        SPSCQueue.ser_num += 1
+
+        # The write index and the counts of puts and drops belong to the
+        # writer; the read index and count of gets belong to the reader
+        self._wr_idx = 0
+        self._rd_idx = 0
+
+        if buffer is None:
+            gc.collect ()
+
+
+    @staticmethod
+    def _needs (type_code, size, *args, **kwargs):
+        """!
+        Find how much memory an @c Arena must set aside for a queue. The
+        parameters are the same as those of the constructor.
+        @return A tuple of the type code and number of items of memory needed
+        """
+        return type_code, size + 1
+
+
+    @micropython.native
+    def put (self, item):
+        """!
+        Put an item into the queue, or drop it and count an overflow if the
+        queue is full. This method never waits and may be called from an
+        interrupt service routine.
+        @param item The item to be placed into the queue
+        @return @c True if the item was put in, @c False if it was dropped
+        """
+        wr_idx = self._wr_idx
+        next_idx = wr_idx + 1
+        if next_idx >= self._slots:
+            next_idx = 0
+        rd_idx = self._rd_idx
+        if next_idx == rd_idx:
+            self._drops = (self._drops + 1) & 0x3FFFFFFF
+            return False
+
+        # Write the data before moving the index which makes it visible
+        self._buffer[wr_idx] = item
+        self._wr_idx = next_idx
+        self._puts = (self._puts + 1) & 0x3FFFFFFF
+
+        # Record the maximum fill, as seen by the writer
+        count = next_idx - rd_idx
+        if count < 0:
+            count += self._slots
+        if count > self._max_full:
+            self._max_full = count
+        if count > self._win_max:
+            self._win_max = count
+
+        self._wake_getter ()
+        return True
+
+
+    @micropython.native
+    def get (self):
+        """!
+        Read an item from the queue. This method never waits; one should call
+        @c any() to make sure that the queue isn't empty before calling it.
+        @return The oldest item in the queue, or @c None if the queue is empty
+        """
+        rd_idx = self._rd_idx
+        if rd_idx == self._wr_idx:
+            return None
+
+        # Read the data before moving the index which frees its slot
+        to_return = self._buffer[rd_idx]
+        rd_idx += 1
+        if rd_idx >= self._slots:
+            rd_idx = 0
+        self._rd_idx = rd_idx
+        self._gets = (self._gets + 1) & 0x3FFFFFFF
+
+        return to_return
+
+
+    @micropython.native
+    def any (self):
+        """!
+        Check if there are any items in the queue.
+        @return @c True if items are in the queue, @c False if not
+        """
+        return self._rd_idx != self._wr_idx
+
+
+    @micropython.native
+    def num_in (self):
+        """!
+        Check how many items are in the queue. If the writer interrupts the
+        reader, the number may have grown by the time it's used.
+        @return The number of items in the queue
+        """
+        count = self._wr_idx - self._rd_idx
+        if count < 0:
+            count += self._slots
+        return count
+
+
+    def overflows (self):
+        """!
+        Find how many items have been dropped because the queue was full.
+        @return The number of items dropped
+        """
+        return self._drops
+
+
+    def _level (self):
+        """!
+        Find how many items are in the queue, for @c metrics().
+        @return The number of items in the queue
+        """
+        return self.num_in ()
+
+
+    def wait_any (self, task):
+        """!
+        Make the reading task wait, without blocking other tasks, until there's
+        data in the queue. This works as @c Queue.wait_any() does.
+        @param task The task which is running, usually found with
+               @c cotask.current_task()
+        @return @c True if the task has been parked and should yield
+        """
+        if self._rd_idx != self._wr_idx:
+            if task.period is None:
+                task.go ()
+            return False
+        self._park (task, True)
+
+        # If the writer put data in just before the task was parked, wake the
+        # task so that it runs again as soon as it has yielded
+        if self._rd_idx != self._wr_idx:
+            self._wake_getter ()
+        return True
+
+
+    def __repr__ (self):
+        """!
+        This method puts diagnostic information about the queue into a string,
+        showing the queue's name, type and size and how many items have been
+        dropped.
+        """
+        return ('{:<12s} SPSCQueue<{:s}> {:d}/{:d} Dropped {:d}'.format (
+                self._name, type_code_strings[self._type_code],
+                self.num_in (), self._size, self._drops))
+
+
+# ============================================================================
+
+class Broadcast (BaseShare):
+    """!
+    A ring buffer with one writer which many readers can each read in full.
+
+    Every reader, made by @c subscribe(), keeps its own place in the stream,
+    so each item put in is seen by all the readers without being copied
+    into a queue for each of them. The writer never waits: when the buffer
+    is full the oldest item is overwritten, and a reader which has fallen
+    more than @c size items behind skips the items it missed and counts
+    them as overruns. No interrupts are disabled, so the writer may be an
+    interrupt service routine, but the readers must be tasks.
+
+    @code
+    import task_share
+
+    encoder = task_share.Broadcast ('l', 32, name="Encoder")
+    for_control = encoder.subscribe ("Control")
+    for_logger = encoder.subscribe ("Logger")
+
+    # In the task or interrupt service routine which reads the encoder
+    encoder.put (position)
+
+    # In the control task, and likewise in the logger task
+    while for_control.any ():
+        position = for_control.get ()
+    @endcode
+    """
+    ## A counter used to give serial numbers to broadcasts for diagnostic use.
+    ser_num = 0
+
+    def __init__ (self, type_code, size, name = None, buffer = None):
+        """!
+        Initialize a broadcast ring buffer.
+        @param type_code The type of data items which the buffer can hold,
+               given as for a @c Queue
+        @param size The number of items which a reader can fall behind
+               before it loses data
+        @param name A short name for the buffer, default @c BroadcastN where
+               @c N is a serial number for the buffer
+        @param buffer A @c memoryview of @c size + 1 items of type
+               @c type_code, usually given by an @c Arena, or @c None to
+               allocate memory for the buffer here
+        """
+        super ().__init__ (type_code, False, name)
+
+        # There's one spare slot so that the oldest item a reader may still
+        # be reading isn't overwritten until it has fallen a whole buffer
+        # behind
+        self._size = size
+        self._slots = size + 1
+        if buffer is not None:
+            self._buffer = buffer
+        else:
+            self._buffer = array.array (type_code, range (self._slots))
+        self._name = str (name) if name != None \
+            else 'Broadcast' + str (Broadcast.ser_num)
+        Broadcast.ser_num += 1
+
+        # The write index, and the number of items ever written. The count
+        # wraps around at 2**30 to stay a small integer; readers compare
+        # their own counts with it to find how far behind they are
+        self._wr_idx = 0
+        self._count = 0
+        self._readers = []
+
+        if buffer is None:
+            gc.collect ()
+
+
+    @staticmethod
+    def _needs (type_code, size, *args, **kwargs):
+        """!
+        Find how much memory an @c Arena must set aside for a broadcast
+        buffer. The parameters are the same as those of the constructor.
+        @return A tuple of the type code and number of items of memory needed
+        """
+        return type_code, size + 1
+
+
+    def subscribe (self, name = None):
+        """!
+        Make a new reader for this buffer. The reader will see items which
+        are put in from now on.
+        @param name A short name for the reader, used in printouts
+        @return A new @c BroadcastReader
+        """
+        reader = BroadcastReader (self, name)
+        self._readers.append (reader)
+        return reader
+
+
+    @micropython.native
+    def put (self, item):
+        """!
+        Put an item into the buffer for all readers to see. This method never
+        waits and may be called from an interrupt service routine. If a
+        reader is too far behind, the oldest item is overwritten before that
+        reader has seen it.
+        @param item The item to be placed into the buffer
+        """
+        # Write the data before counting it, which makes it visible
+        wr_idx = self._wr_idx
+        self._buffer[wr_idx] = item
+        wr_idx += 1
+        if wr_idx >= self._slots:
+            wr_idx = 0
+        self._wr_idx = wr_idx
+        self._count = (self._count + 1) & 0x3FFFFFFF
+        self._puts = (self._puts + 1) & 0x3FFFFFFF
+
+        # Wake any readers' tasks which are waiting for data, and the tasks
+        # which have subscribed
+        for reader in self._readers:
+            task = reader._waiter
+            if task is not None:
+                reader._waiter = None
+                task.go ()
+        for task in self._subscribers:
+            task.go ()
+
+
+    def _level (self):
+        """!
+        Find how far behind the slowest reader is, for @c metrics().
+        @return The largest number of unread items of any reader
+        """
+        most = 0
+        for reader in self._readers:
+            lag = reader.num_in ()
+            if lag > most:
+                most = lag
+        return most
+
+
+    def __repr__ (self):
+        """!
+        This method puts diagnostic information about the buffer into a
+        string, showing its name, type and size and, for each reader, how
+        many items it has missed because it fell too far behind.
+        """
+        text = '{:<12s} Broadcast<{:s}> Size {:d} Max Lag {:d}'.format (
+                self._name, type_code_strings[self._type_code], self._size,
+                self._max_full)
+        for reader in self._readers:
+            text += ' {:s}:{:d}'.format (reader._name, reader._overruns)
+        return text
+
+
+class BroadcastReader:
+    """!
+    One reader's place in a @c Broadcast buffer, made by
+    @c Broadcast.subscribe().
+
+    The methods are like those of a @c SPSCQueue: @c get() never waits and
+    returns @c None if there's nothing new, and @c wait_any() parks a task
+    until the writer puts something in. Each reader should be used by only
+    one task.
+    """
+
+    def __init__ (self, source, name = None):
+        """!
+        Create a reader which starts at the newest end of a buffer.
+        @param source The @c Broadcast buffer to be read
+        @param name A short name for the reader, default @c ReaderN where
+               @c N is the number of readers the buffer already has
+        """
+        self._source = source
+        self._name = str (name) if name != None \
+            else 'Reader' + str (len (source._readers))
+        self._rd_idx = source._wr_idx
+        self._count = source._count
+        self._overruns = 0
+        self._waiter = None
+
+
+    @micropython.native
+    def num_in (self):
+        """!
+        Find how many items this reader hasn't read yet. If the reader has
+        fallen behind, the number can be larger than the buffer's size; the
+        extra items have been lost.
+        @return The number of unread items
+        """
+        return (self._source._count - self._count) & 0x3FFFFFFF
+
+
+    @micropython.native
+    def any (self):
+        """!
+        Check if there are any items which this reader hasn't read yet.
+        @return @c True if there are unread items
+        """
+        return self._source._count != self._count
+
+
+    @micropython.native
+    def get (self):
+        """!
+        Read the oldest item which this reader hasn't read yet. If the reader
+        has fallen more than a buffer's size behind, the items which have
+        been overwritten are skipped and counted as overruns.
+        @return The item, or @c None if there are no unread items
+        """
+        source = self._source
+        slots = source._slots
+        while True:
+            lag = (source._count - self._count) & 0x3FFFFFFF
+            if lag == 0:
+                return None
+            if lag > source._size:
+                # Skip to the oldest item which hasn't been overwritten
+                skip = lag - source._size
+                self._overruns += skip
+                source._drops = (source._drops + skip) & 0x3FFFFFFF
+                self._count = (self._count + skip) & 0x3FFFFFFF
+                self._rd_idx = (self._rd_idx + skip) % slots
+                lag = source._size
+            if lag > source._max_full:
+                source._max_full = lag
+            if lag > source._win_max:
+                source._win_max = lag
+
+            # Read the item, then make sure that the writer didn't overwrite
+            # it in the meantime; if it did, try again
+            to_return = source._buffer[self._rd_idx]
+            if ((source._count - self._count) & 0x3FFFFFFF) <= source._size:
+                break
+
+        rd_idx = self._rd_idx + 1
+        if rd_idx >= slots:
+            rd_idx = 0
+        self._rd_idx = rd_idx
+        self._count = (self._count + 1) & 0x3FFFFFFF
+        source._gets = (source._gets + 1) & 0x3FFFFFFF
+        return to_return
+
+
+    def overruns (self):
+        """!
+        Find how many items this reader has missed because it fell more than
+        a buffer's size behind the writer.
+        @return The number of items missed
+        """
+        return self._overruns
+
+
+    def wait_any (self, task):
+        """!
+        Make the reading task wait, without blocking other tasks, until there's
+        an item it hasn't read. This works as @c Queue.wait_any() does.
+        @param task The task which is running, usually found with
+               @c cotask.current_task()
+        @return @c True if the task has been parked and should yield
+        """
+        if self.any ():
+            if task.period is None:
+                task.go ()
+            return False
+        task.park ()
+        self._waiter = task
+
+        # If the writer put data in just before the task was parked, wake the
+        # task so that it runs again as soon as it has yielded
+        if self.any ():
+            self._waiter = None
+            task.go ()
+        return True
+
+
 # ============================================================================
 
 class Share (BaseShare):
@@ -359,7 +1652,8 @@ class Share (BaseShare):
     ser_num = 0
 
 
-    def __init__ (self, type_code, thread_protect = True, name = None):
+    def __init__ (self, type_code, thread_protect = True, name = None,
+                  buffer = None):
         """!
         Create a shared data item used to transfer data between tasks.
 
@@ -382,17 +1676,33 @@ class Share (BaseShare):
         @param thread_protect True if mutual exclusion protection is used
         @param name A short name for the share, default @c ShareN where @c N
                is a serial number for the share
+        @param buffer A @c memoryview of one item of type @c type_code,
+               usually given by an @c Arena, or @c None to allocate memory
+               for the share here
         """
         # First call the parent class initializer
         super ().__init__ (type_code, thread_protect, name)
 
-        self._buffer = array.array (type_code, [0])
+        if buffer is not None:
+            self._buffer = buffer
+        else:
+            self._buffer = array.array (type_code, [0])
 
         self._name = str (name) if name != None \
             else 'Share' + str (Share.ser_num)
         Share.ser_num += 1
 
 
+    @staticmethod
+    def _needs (type_code, *args, **kwargs):
+        """!
+        Find how much memory an @c Arena must set aside for a share. The
+        parameters are the same as those of the constructor.
+        @return A tuple of the type code and number of items of memory needed
+        """
+        return type_code, 1
+
+
     @micropython.native
     def put (self, data, in_ISR = False):
         """!
@@ -409,12 +1719,20 @@ class Share (BaseShare):
         # Disable interrupts before writing the data
         if self._thread_protect and not in_ISR:
             irq_state = pyb.disable_irq ()
+            if self._irq_hist is not None:
+                irq_start = utime.ticks_us ()
 
         self._buffer[0] = data
+        self._puts = (self._puts + 1) & 0x3FFFFFFF
 
         # Re-enable interrupts
         if self._thread_protect and not in_ISR:
             pyb.enable_irq (irq_state)
+            if self._irq_hist is not None:
+                self._irq_off_time (irq_start)
+
+        # If a task is waiting for new data, wake it
+        self._wake_getter ()
 
 
     @micropython.native
@@ -430,16 +1748,41 @@ class Share (BaseShare):
         # Disable interrupts before reading the data
         if self._thread_protect and not in_ISR:
             irq_state = pyb.disable_irq ()
+            if self._irq_hist is not None:
+                irq_start = utime.ticks_us ()
 
         to_return = self._buffer[0]
+        self._gets = (self._gets + 1) & 0x3FFFFFFF
 
         # Re-enable interrupts
         if self._thread_protect and not in_ISR:
             pyb.enable_irq (irq_state)
+            if self._irq_hist is not None:
+                self._irq_off_time (irq_start)
 
         return (to_return)
 
 
+    def wait_put (self, task):
+        """!
+        Park a task until the next time data is put into the share.
+
+        Unlike a queue, a share always holds a value, so this method always
+        parks the task. The task should yield after calling it; its next run
+        will be after new data has been put into the share:
+        @code
+        |   while True:
+        |       my_share.wait_put (me)
+        |       yield 0
+        |       do_something_with (my_share.get ())
+        @endcode
+        Only one task can wait for each share at a time.
+        @param task The task which is running, usually found with
+               @c cotask.current_task()
+        """
+        self._park (task, True)
+
+
     def __repr__ (self):
         """!
         Puts diagnostic information about the share into a string.
@@ -450,3 +1793,303 @@ class Share (BaseShare):
                 type_code_strings[self._type_code]))
 
 
+
+
+# ============================================================================
+
+class SeqShare (BaseShare):
+    """!
+    A share holding several fields which are always read as a consistent set,
+    without disabling interrupts.
+
+    The fields are laid out by a @c struct format string and kept in one
+    @c bytearray. A sequence counter guards them: the writer makes the
+    counter odd before it changes the fields and even again afterwards, and
+    a reader which sees an odd counter, or a counter which changed while it
+    was reading, knows that it may have read a mix of old and new fields and
+    reads again. This is often called a "seqlock." 
+
+    There must be only one writer, and it must be able to interrupt the
+    readers but not be interrupted by them; the usual case is an interrupt
+    service routine which writes and tasks which read. A reader which
+    interrupts the writer could never see a finished write, so @c get()
+    gives up after a number of tries.
+
+    @code
+    import task_share
+
+    # Encoder position (int32) and the time at which it was read (uint32)
+    enc_state = task_share.SeqShare ('<lI', name="Enc State")
+
+    # In a task which writes the share
+    enc_state.put (position, utime.ticks_us ())
+
+    # In an interrupt service routine which writes the share, where memory
+    # can't be allocated for the arguments of put ()
+    enc_state.begin_put ()
+    enc_state.set_field (0, position)
+    enc_state.set_field (1, utime.ticks_us ())
+    enc_state.end_put ()
+
+    # In a task which reads the share
+    position, time = enc_state.get ()
+    @endcode
+    """
+    ## A counter used to give serial numbers to shares for diagnostic use.
+    ser_num = 0
+
+    def __init__ (self, fmt, name = None, buffer = None):
+        """!
+        Create a multi-field share and allocate memory for its fields, which
+        start out as zeros.
+        @param fmt A @c struct format string giving the layout of the fields
+        @param name A short name for the share, default @c SeqShareN where
+               @c N is a serial number for the share
+        @param buffer A @c memoryview of bytes big enough for the fields,
+               usually given by an @c Arena, or @c None to allocate memory
+               for the share here
+        """
+        # Check the format and find the fields before this share is put into
+        # the list of shares, so that a bad format doesn't leave a half made
+        # share there
+        size = struct.calcsize (fmt)
+        fields = SeqShare._find_fields (fmt)
+        super ().__init__ (fmt, False, name)
+
+        if buffer is not None:
+            self._buffer = buffer
+        else:
+            self._buffer = bytearray (size)
+        self._seq = 0
+        self._retries = 0
+        self._fields = fields
+
+        self._name = str (name) if name != None \
+            else 'SeqShare' + str (SeqShare.ser_num)
+        SeqShare.ser_num += 1
+
+
+    @staticmethod
+    def _needs (fmt, *args, **kwargs):
+        """!
+        Find how much memory an @c Arena must set aside for a share. The
+        parameters are the same as those of the constructor.
+        @return A tuple of the type code and number of items of memory needed
+        """
+        return 'B', struct.calcsize (fmt)
+
+
+    @staticmethod
+    def _find_fields (fmt):
+        """!
+        Find the format and offset of each field for @c set_field(). A repeat
+        count makes that many fields, except before @c s, where it gives the
+        length of one string field. Pad bytes and whitespace aren't fields.
+        The offset of a field is the size of the format up to and including
+        it, less its own size, which allows for any alignment padding.
+        @param fmt A @c struct format string
+        @return A tuple holding a (format, offset) tuple for each field
+        """
+        order = fmt[0] if fmt and fmt[0] in '@=<>!' else ''
+        done = order
+        fields = []
+        count = ''
+        for char in fmt[len (order):]:
+            if char.isdigit ():
+                count += char
+                continue
+            if char.isspace ():
+                continue
+            if char == 's':
+                codes = (count + char,)
+            else:
+                codes = (char,) * (int (count) if count else 1)
+            count = ''
+            for code in codes:
+                if code != 'x':
+                    offset = struct.calcsize (done + code) \
+                        - struct.calcsize (order + code)
+                    fields.append ((order + code, offset))
+                done += code
+        return tuple (fields)
+
+
+    @micropython.native
+    def put (self, *values):
+        """!
+        Write all the fields of the share. Interrupts aren't disabled. Only
+        one piece of code, usually an interrupt service routine, may write to
+        a given share. Passing the values as separate arguments allocates a
+        little memory, so a hard interrupt service routine should use
+        @c begin_put(), @c set_field() and @c end_put() instead.
+        @param values The values of the fields, in order
+        """
+        # An odd sequence number tells readers that a write is under way
+        self._seq = (self._seq + 1) & 0x3FFFFFFF
+        struct.pack_into (self._type_code, self._buffer, 0, *values)
+        self._seq = (self._seq + 1) & 0x3FFFFFFF
+        self._puts = (self._puts + 1) & 0x3FFFFFFF
+
+        self._wake_getter ()
+
+
+    @micropython.native
+    def begin_put (self):
+        """!
+        Start writing fields one at a time with @c set_field(). Readers will
+        retry until @c end_put() is called.
+        """
+        self._seq = (self._seq + 1) & 0x3FFFFFFF
+
+
+    @micropython.native
+    def set_field (self, index, value):
+        """!
+        Write one field of the share without allocating memory. This must be
+        done between calls to @c begin_put() and @c end_put(). Fields are
+        numbered from 0 in the order of the values given to @c put(), so a
+        format such as @c '<2lI' has three fields.
+        @param index The number of the field
+        @param value The new value of the field
+        """
+        code, offset = self._fields[index]
+        struct.pack_into (code, self._buffer, offset, value)
+
+
+    @micropython.native
+    def end_put (self):
+        """!
+        Finish writing fields which were started with @c begin_put(), letting
+        readers see the new values.
+        """
+        self._seq = (self._seq + 1) & 0x3FFFFFFF
+        self._puts = (self._puts + 1) & 0x3FFFFFFF
+        self._wake_getter ()
+
+
+    @micropython.native
+    def get (self, max_tries = 10):
+        """!
+        Read all the fields of the share as one consistent set. If the writer
+        changes the fields while they're being read, they are read again.
+        @param max_tries The most times to try reading before giving up
+        @return A tuple of the field values, or @c None if no consistent set
+                could be read in @c max_tries tries
+        """
+        for count in range (max_tries):
+            seq = self._seq
+            if not seq & 1:
+                values = struct.unpack_from (self._type_code, self._buffer, 0)
+                if self._seq == seq:
+                    self._gets = (self._gets + 1) & 0x3FFFFFFF
+                    return values
+            self._retries += 1
+        return None
+
+
+    def wait_put (self, task):
+        """!
+        Park a task until the next time the share is written. This works as
+        @c Share.wait_put() does.
+        @param task The task which is running, usually found with
+               @c cotask.current_task()
+        """
+        self._park (task, True)
+
+
+    def __repr__ (self):
+        """!
+        Puts diagnostic information about the share into a string, showing
+        its name and format and how many reads had to be retried.
+        """
+        return ("{:<12s} SeqShare<{:s}> Retries {:d}".format (self._name,
+                self._type_code, self._retries))
+
+
+# ============================================================================
+
+class Arena:
+    """!
+    A set of queues and shares whose memory is allocated all at once.
+
+    Creating each queue on its own allocates its buffer separately and runs
+    the garbage collector each time, so starting a program with many queues
+    is slow and leaves the heap in pieces. Instead, the queues and shares
+    can be declared to an arena with @c add() and then made together by
+    @c build(). The arena adds up the memory needed for each type of data,
+    allocates one array for each type, gives each queue or share a slice of
+    it, and runs the garbage collector once at the end.
+
+    @code
+    import task_share
+
+    arena = task_share.Arena ()
+    arena.add (task_share.Share, 'h', thread_protect=False, name="Share 0")
+    arena.add (task_share.Queue, 'L', 16, name="Queue 0")
+    arena.add (task_share.RecordQueue, '<Il', 32, name="Samples")
+    share0, q0, samples = arena.build ()
+    @endcode
+    """
+
+    def __init__ (self):
+        """!
+        Create an empty arena.
+        """
+        self._specs = []
+
+
+    def add (self, share_class, *args, **kwargs):
+        """!
+        Declare a queue or share to be made by @c build().
+        @param share_class The class of the queue or share, such as
+               @c task_share.Queue
+        @param args The parameters for the class's constructor
+        @param kwargs The keyword parameters for the class's constructor
+        """
+        self._specs.append ((share_class, args, kwargs))
+
+
+    def build (self):
+        """!
+        Allocate memory for all the queues and shares which have been
+        declared, then make them.
+        @return A tuple of the queues and shares, in the order in which they
+                were declared with @c add()
+        """
+        # Add up the number of items of each type which will be needed
+        needs = []
+        totals = {}
+        for share_class, args, kwargs in self._specs:
+            type_code, count = share_class._needs (*args, **kwargs)
+            needs.append ((type_code, count))
+            totals[type_code] = totals.get (type_code, 0) + count
+
+        # Allocate one array of zeros for each type. Bytes for records are
+        # kept in a bytearray; other arrays are copied from a zeroed buffer
+        # of the right size in one step, as filling them from a generator
+        # would make MicroPython reallocate the array as it grows
+        arrays = {}
+        for type_code, total in totals.items ():
+            if type_code == 'B':
+                memory = bytearray (total)
+            else:
+                memory = array.array (type_code,
+                    bytes (total * struct.calcsize (type_code)))
+            arrays[type_code] = memoryview (memory)
+
+        # Make each queue or share with its slice of the memory
+        made = []
+        offsets = {}
+        for index in range (len (self._specs)):
+            share_class, args, kwargs = self._specs[index]
+            type_code, count = needs[index]
+            start = offsets.get (type_code, 0)
+            offsets[type_code] = start + count
+            made.append (share_class (*args,
+                                      buffer = arrays[type_code][start:start
+                                                                 + count],
+                                      **kwargs))
+        self._specs = []
+
+        gc.collect ()
+        return tuple (made)
@@ -0,0 +1,608 @@
+"""!
+@file telemetry.py
+This file contains classes which pack motor samples into small binary frames
+for sending over a UART, and unpack them again on the PC.
+
+Sending a sample as text, such as @c "motor 1,12345,-678\r\n", takes about 20
+bytes and makes a new string each time. A binary frame takes 10 bytes and is
+packed into a buffer which is allocated once, so sending samples doesn't
+allocate memory in the control loop. Each frame is laid out as follows, with
+multi-byte fields little-endian:
+
+| Byte | Field |
+|:-----|:------|
+| 0    | Sync byte, always @c 0xA5 |
+| 1    | Sequence number, counting up by one for each frame of a motor |
+| 2    | Motor number; @c END marks the end of the data |
+| 3-4  | Time in milliseconds, modulo 65536 |
+| 5-8  | Position in encoder counts, signed |
+| 9    | CRC-8 of bytes 1 to 8 |
+
+The receiver finds frames by their sync bytes, and it uses the CRC to skip
+bytes which only look like a sync byte or which were corrupted. Gaps in the
+sequence numbers show how many frames were lost. The time is sent modulo
+65536 ms and unwrapped by the receiver, which works as long as frames for a
+motor are less than a minute apart.
+
+To send more samples over the same link, a compressed stream can be used
+instead. Because a motor moves only a little between samples, most samples
+are sent as the change in time and position since the motor's previous
+sample. Each change is zig-zag encoded, so that small negative numbers
+become small positive ones, then sent as a varint, seven bits to a byte with
+the top bit set in every byte but the last; a change of less than 64 takes
+one byte. Changes are gathered into packets:
+
+| Byte | Field |
+|:-----|:------|
+| 0    | Sync byte, always @c 0xA6 |
+| 1    | Packet sequence number, counting up by one for each packet |
+| 2    | Number of payload bytes, @c n |
+| 3 to n+2 | Each sample's motor number and varint changes of time, position |
+| n+3  | CRC-8 of bytes 1 to n+2 |
+
+Every so often, and whenever a motor's first sample is sent, a sample is
+sent as an ordinary frame instead. These keyframes give the receiver the
+whole time and position, so that it can start decoding changes, and start
+again after a packet has been lost.
+
+This file is used both by the MicroPython program which sends the frames and
+by the PC program which receives them, so it uses only modules which both
+have.
+"""
+
+import struct
+
+
+## The first byte of every frame
+SYNC = 0xA5
+
+## The motor number in the frame which marks the end of the data
+END = 0xFF
+
+## The first byte of every packet of changes in a compressed stream
+DELTA_SYNC = 0xA6
+
+## The @c struct format of a frame, not counting the CRC byte at its end
+FRAME_FORMAT = '<BBBHl'
+
+## The number of bytes in a frame, including the CRC
+FRAME_SIZE = struct.calcsize (FRAME_FORMAT) + 1
+
+
+def _make_crc_table ():
+    """!
+    Make the table used to find CRC-8 values with the polynomial
+    x^8 + x^2 + x + 1 (0x07).
+    @return A @c bytes object of 256 table entries
+    """
+    table = bytearray (256)
+    for index in range (256):
+        crc = index
+        for bit in range (8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ 0x07) & 0xFF
+            else:
+                crc = (crc << 1) & 0xFF
+        table[index] = crc
+    return bytes (table)
+
+
+# The CRC table is made once when this file is imported
+_CRC_TABLE = _make_crc_table ()
+
+
+def crc8 (data, start, end):
+    """!
+    Find the CRC-8 of some bytes, using a table so that each byte takes only
+    one lookup.
+    @param data A @c bytes, @c bytearray or @c memoryview holding the bytes
+    @param start The index of the first byte to be checked
+    @param end The index just past the last byte to be checked
+    @return The CRC, from 0 to 255
+    """
+    crc = 0
+    table = _CRC_TABLE
+    for index in range (start, end):
+        crc = table[crc ^ data[index]]
+    return crc
+
+
+class FrameWriter:
+    """!
+    Packs samples from one motor into binary frames.
+
+    The frame is packed into the same buffer each time, so the buffer must be
+    sent before the next sample is packed:
+    @code
+        frames_1 = telemetry.FrameWriter (1)
+        ...
+        u2.write (frames_1.pack (time_1, pos_1))
+    @endcode
+    """
+
+    def __init__ (self, motor):
+        """!
+        Create a frame writer and allocate its buffer.
+        @param motor The motor number which is put into each frame, from 0
+               to 254
+        """
+        self._motor = motor
+        self._seq = 0
+        self._buffer = bytearray (FRAME_SIZE)
+
+
+    def pack (self, time, position):
+        """!
+        Pack a sample into a frame.
+        @param time The time of the sample in milliseconds
+        @param position The motor's position in encoder counts
+        @return The buffer holding the frame, which is reused by the next call
+        """
+        self.pack_into (self._buffer, 0, time, position)
+        return self._buffer
+
+
+    def pack_into (self, buffer, offset, time, position):
+        """!
+        Pack a sample into a frame in a given buffer, so that several frames
+        can be put into one buffer and sent together.
+        @param buffer A @c bytearray with room for the frame
+        @param offset The index in @c buffer at which the frame starts
+        @param time The time of the sample in milliseconds
+        @param position The motor's position in encoder counts
+        """
+        struct.pack_into (FRAME_FORMAT, buffer, offset, SYNC, self._seq,
+                          self._motor, time & 0xFFFF, position)
+        buffer[offset + FRAME_SIZE - 1] = crc8 (buffer, offset + 1,
+                                                offset + FRAME_SIZE - 1)
+        self._seq = (self._seq + 1) & 0xFF
+
+
+    def end (self):
+        """!
+        Pack a frame which tells the receiver that no more data will be sent.
+        @return The buffer holding the frame
+        """
+        buffer = self._buffer
+        struct.pack_into (FRAME_FORMAT, buffer, 0, SYNC, self._seq, END, 0, 0)
+        buffer[FRAME_SIZE - 1] = crc8 (buffer, 1, FRAME_SIZE - 1)
+        return buffer
+
+
+def _zigzag (value):
+    """!
+    Map a signed integer to an unsigned one so that numbers near zero, of
+    either sign, stay small: 0, -1, 1, -2, 2 become 0, 1, 2, 3, 4.
+    @param value The signed integer
+    @return The unsigned integer
+    """
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+
+def _unzigzag (value):
+    """!
+    Undo @c _zigzag().
+    @param value The unsigned integer
+    @return The signed integer
+    """
+    return -((value + 1) >> 1) if value & 1 else value >> 1
+
+
+def _put_varint (buffer, index, value):
+    """!
+    Write an unsigned integer as a varint, seven bits at a time starting with
+    the lowest, with the top bit set in every byte but the last.
+    @param buffer A @c bytearray with room for the varint
+    @param index The index in @c buffer at which to write
+    @param value The unsigned integer
+    @return The index just past the varint
+    """
+    while value >= 0x80:
+        buffer[index] = (value & 0x7F) | 0x80
+        value >>= 7
+        index += 1
+    buffer[index] = value
+    return index + 1
+
+
+class DeltaPacker:
+    """!
+    Packs samples into a compressed stream of packets of changes and
+    keyframes.
+
+    The packer remembers each motor's last time and position, so all the
+    samples of a stream must go through the same packer, in order.
+    """
+
+    ## The most bytes which one sample can take in a packet of changes: the
+    #  motor number and two varints of up to five bytes each
+    MAX_DELTA_SIZE = 11
+
+    def __init__ (self, keyframe_every = 50):
+        """!
+        Create a packer for a new stream.
+        @param keyframe_every The number of samples of a motor sent as
+               changes between keyframes; at 50 samples per second, the
+               default of 50 sends a keyframe each second
+        """
+        self._every = keyframe_every
+        self._seq = 0
+
+        # Each motor's frame writer for keyframes, and a list holding the
+        # time and position of its last sample and the number of samples
+        # since its last keyframe
+        self._writers = {}
+        self._last = {}
+
+
+    def pack_into (self, buffer, records, count):
+        """!
+        Pack samples into packets and keyframes.
+        @param buffer A @c bytearray with room for at least
+               @c count * (FRAME_SIZE + 4 + MAX_DELTA_SIZE) bytes
+        @param records A buffer of samples in the format @c SAMPLE_FORMAT
+        @param count The number of samples in @c records
+        @return The number of bytes put into @c buffer
+        """
+        end = 0
+        start = -1                           # Start of the open packet
+        for index in range (count):
+            motor, time, position = struct.unpack_from (
+                SAMPLE_FORMAT, records, index * SAMPLE_SIZE)
+            last = self._last.get (motor)
+
+            # Send a keyframe if it's time for one, closing any open packet
+            # first so that the samples stay in order
+            if last is None or last[2] >= self._every:
+                if start >= 0:
+                    end = self._close (buffer, start, end)
+                    start = -1
+                writer = self._writers.get (motor)
+                if writer is None:
+                    writer = FrameWriter (motor)
+                    self._writers[motor] = writer
+                writer.pack_into (buffer, end, time, position)
+                end += FRAME_SIZE
+                self._last[motor] = [time, position, 0]
+                continue
+
+            # Otherwise add the changes to the open packet, starting a new one
+            # if there isn't one or it might not have room
+            if start >= 0 and end - start - 3 > 255 - self.MAX_DELTA_SIZE:
+                end = self._close (buffer, start, end)
+                start = -1
+            if start < 0:
+                start = end
+                end += 3
+            buffer[end] = motor
+            end = _put_varint (buffer, end + 1, _zigzag (time - last[0]))
+            end = _put_varint (buffer, end, _zigzag (position - last[1]))
+            last[0] = time
+            last[1] = position
+            last[2] += 1
+
+        if start >= 0:
+            end = self._close (buffer, start, end)
+        return end
+
+
+    def _close (self, buffer, start, end):
+        """!
+        Fill in the header and CRC of a packet of changes.
+        @param buffer The buffer holding the packet
+        @param start The index of the packet's sync byte
+        @param end The index just past the packet's payload
+        @return The index just past the packet's CRC
+        """
+        buffer[start] = DELTA_SYNC
+        buffer[start + 1] = self._seq
+        buffer[start + 2] = end - start - 3
+        buffer[end] = crc8 (buffer, start + 1, end)
+        self._seq = (self._seq + 1) & 0xFF
+        return end + 1
+
+
+## The @c struct format of the samples which control tasks put into the queue
+#  read by a @c Sender: the motor number, time in milliseconds and position
+SAMPLE_FORMAT = '<BIl'
+
+## The number of bytes in a sample
+SAMPLE_SIZE = struct.calcsize (SAMPLE_FORMAT)
+
+
+class Sender:
+    """!
+    A task which sends samples from a queue over a UART, so that control
+    tasks never wait for the UART.
+
+    Control tasks pack each sample into a record in the format
+    @c SAMPLE_FORMAT and put it into a @c task_share.RecordQueue, which
+    doesn't wait; if the queue is full the sample is dropped and counted by
+    the queue. The sender's @c run() method is the function of a low
+    priority task. Each time it runs, if the UART has finished sending, it
+    takes up to a batch of samples out of the queue and writes them all at
+    once, as binary frames, as a compressed stream or as lines of text.
+    Writing to a UART on the pyboard waits until the bytes have gone out, so
+    the batch size limits how long each run takes; at 115200 baud a 10 byte
+    frame takes about 0.9 ms.
+    @code
+        samples = task_share.RecordQueue(telemetry.SAMPLE_FORMAT, 32)
+        sender = telemetry.Sender(u2, samples, mode='bin')
+        task3 = cotask.Task(sender.run, name="Sender", priority=0, period=10)
+
+        # In a control task
+        struct.pack_into(telemetry.SAMPLE_FORMAT, record_1, 0, 1, time, pos)
+        samples.put_record(record_1)
+    @endcode
+    """
+
+    def __init__ (self, uart, samples, mode = 'bin', batch = 4):
+        """!
+        Create a sender and allocate its buffers.
+        @param uart The UART through which samples are sent
+        @param samples The @c task_share.RecordQueue from which samples in
+               the format @c SAMPLE_FORMAT are taken
+        @param mode @c 'bin' to send binary frames, @c 'delta' to send a
+               compressed stream, or @c 'text' to send lines of text such as
+               @c "motor 1,12345,-678\r\n"
+        @param batch The most samples which are sent in one run
+        """
+        self._uart = uart
+        self._samples = samples
+        self._binary = mode != 'text'
+        self._records = bytearray (batch * SAMPLE_SIZE)
+        self._frames = bytearray (batch * (FRAME_SIZE + 4
+                                           + DeltaPacker.MAX_DELTA_SIZE))
+        self._frames_view = memoryview (self._frames)
+        self._packer = DeltaPacker () if mode == 'delta' else None
+
+        # A frame writer for each motor, made when its first sample is sent,
+        # so that each motor has its own sequence numbers
+        self._writers = {}
+
+        ## The number of samples which have been sent
+        self.sent = 0
+
+
+    def run (self):
+        """!
+        The task function which sends samples; it's given to @c cotask.Task.
+        """
+        while True:
+            if self._uart.txdone ():
+                self.send_batch ()
+            yield 0
+
+
+    def send_batch (self):
+        """!
+        Take up to a batch of samples out of the queue and write them to the
+        UART.
+        @return The number of samples sent
+        """
+        count = self._samples.get_many (self._records)
+        if count == 0:
+            return 0
+        if self._packer is not None:
+            size = self._packer.pack_into (self._frames, self._records, count)
+            self._uart.write (self._frames_view[:size])
+        elif self._binary:
+            for index in range (count):
+                motor, time, position = struct.unpack_from (
+                    SAMPLE_FORMAT, self._records, index * SAMPLE_SIZE)
+                writer = self._writers.get (motor)
+                if writer is None:
+                    writer = FrameWriter (motor)
+                    self._writers[motor] = writer
+                writer.pack_into (self._frames, index * FRAME_SIZE, time,
+                                  position)
+            self._uart.write (self._frames_view[:count * FRAME_SIZE])
+        else:
+            lines = []
+            for index in range (count):
+                lines.append ('motor {:d},{:d},{:d}\r\n'.format (
+                    *struct.unpack_from (SAMPLE_FORMAT, self._records,
+                                         index * SAMPLE_SIZE)))
+            self._uart.write (''.join (lines))
+        self.sent += count
+        return count
+
+
+    def finish (self):
+        """!
+        Send every sample which is still in the queue, then tell the receiver
+        that the data has ended. This waits for the UART, so it's meant to be
+        called when the program stops.
+        """
+        while self.send_batch ():
+            pass
+        if self._binary:
+            self._uart.write (FrameWriter (END).end ())
+        else:
+            self._uart.write (b'end\r\n')
+
+
+    def dropped (self):
+        """!
+        Find how many samples were dropped because the queue was full.
+        @return The number of samples dropped
+        """
+        return self._samples.metrics ()[2]
+
+
+class FrameReader:
+    """!
+    Finds and unpacks frames in a stream of bytes received from a
+    @c FrameWriter, or frames and packets of changes in a compressed stream
+    from a @c DeltaPacker.
+
+    Bytes may be given in pieces of any size; a frame which is split between
+    pieces is unpacked when the rest of it arrives.
+    @code
+        reader = telemetry.FrameReader ()
+        while True:
+            for motor, time, position in reader.feed (port.read (64)):
+                if motor == telemetry.END:
+                    ...
+    @endcode
+    """
+
+    def __init__ (self):
+        """!
+        Create a frame reader with no data.
+        """
+        self._data = bytearray ()
+
+        # The last sequence number, unwrapped time and position of each
+        # motor, and the last sequence number of a packet of changes. The
+        # positions are forgotten whenever a packet or keyframe may have been
+        # lost, from a gap in the packet sequence numbers, a wrong CRC or
+        # skipped bytes, so that changes aren't used until the next keyframe
+        self._seq = {}
+        self._time = {}
+        self._pos = {}
+        self._delta_seq = None
+
+        ## The number of frames or packets whose CRC was wrong, and of
+        #  packets which ended in the middle of a sample
+        self.bad = 0
+
+        ## The number of frames and packets which were missed, from gaps in
+        #  the sequence numbers, and of changes which couldn't be used
+        #  because they came after a gap and before the next keyframe
+        self.lost = 0
+
+        ## The number of bytes which were skipped while looking for a frame
+        self.skipped = 0
+
+
+    def feed (self, data):
+        """!
+        Add received bytes and unpack the frames and packets which are
+        complete.
+        @param data The bytes which have been received
+        @return A list of (motor, time, position) tuples, one for each
+                sample, with times unwrapped so that they keep counting up
+                past 65535 ms. An end frame gives @c (END, 0, 0)
+        """
+        buffer = self._data
+        buffer += data
+        samples = []
+        index = 0
+        length = len (buffer)
+        while index < length:
+            sync = buffer[index]
+            if sync == SYNC:
+                size = FRAME_SIZE
+            elif sync == DELTA_SYNC:
+                if index + 3 > length:
+                    break
+                size = buffer[index + 2] + 4
+            else:
+                index += 1
+                self.skipped += 1
+                self._pos.clear ()
+                continue
+            if index + size > length:
+                break
+            if crc8 (buffer, index + 1, index + size - 1) \
+                    != buffer[index + size - 1]:
+                # Not a good frame; look for the next sync byte
+                self.bad += 1
+                index += 1
+                self.skipped += 1
+                self._pos.clear ()
+                continue
+
+            if sync == DELTA_SYNC:
+                self._unpack_deltas (buffer, index, size, samples)
+                index += size
+                continue
+
+            sync, seq, motor, time, position = struct.unpack_from (
+                FRAME_FORMAT, buffer, index)
+            index += FRAME_SIZE
+            if motor == END:
+                samples.append ((END, 0, 0))
+                continue
+            time = self._unwrap (motor, seq, time)
+            self._pos[motor] = position
+            samples.append ((motor, time, position))
+
+        del buffer[:index]
+        return samples
+
+
+    def _unpack_deltas (self, buffer, index, size, samples):
+        """!
+        Unpack the changes in a packet whose CRC has been checked, adding
+        them to the last time and position of each motor. A packet which ends
+        in the middle of a sample is dropped and counted as bad.
+        @param buffer The buffer holding the packet
+        @param index The index of the packet's sync byte
+        @param size The size of the packet in bytes
+        @param samples The list to which (motor, time, position) tuples are
+               added
+        """
+        seq = buffer[index + 1]
+        if self._delta_seq is not None:
+            gap = (seq - self._delta_seq - 1) & 0xFF
+            if gap:
+                self.lost += gap
+                self._pos.clear ()
+        self._delta_seq = seq
+
+        # Decode the whole packet before using any of it, so that a
+        # malformed packet doesn't leave some motors updated
+        end = index + size - 1
+        index += 3
+        changes = []
+        while index < end:
+            changes.append (buffer[index])
+            index += 1
+            for field in range (2):
+                value = 0
+                shift = 0
+                while True:
+                    if index >= end:
+                        self.bad += 1
+                        self._pos.clear ()
+                        return
+                    byte = buffer[index]
+                    index += 1
+                    value |= (byte & 0x7F) << shift
+                    shift += 7
+                    if byte < 0x80:
+                        break
+                changes.append (_unzigzag (value))
+
+        for index in range (0, len (changes), 3):
+            motor = changes[index]
+            if motor not in self._pos:
+                self.lost += 1
+                continue
+            time = self._time[motor] + changes[index + 1]
+            position = self._pos[motor] + changes[index + 2]
+            self._time[motor] = time
+            self._pos[motor] = position
+            samples.append ((motor, time, position))
+
+
+    def _unwrap (self, motor, seq, time):
+        """!
+        Count lost frames from a motor's sequence numbers and turn the time,
+        which wraps around every 65536 ms, into a time which keeps counting.
+        @param motor The motor number of a frame
+        @param seq The sequence number of the frame
+        @param time The time in the frame, modulo 65536
+        @return The unwrapped time in milliseconds
+        """
+        if motor in self._seq:
+            self.lost += (seq - self._seq[motor] - 1) & 0xFF
+            wrapped = self._time[motor]
+            total = wrapped + ((time - wrapped) & 0xFFFF)
+        else:
+            total = time
+        self._seq[motor] = seq
+        self._time[motor] = total
+        return total